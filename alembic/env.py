@@ -1,13 +1,15 @@
 import asyncio
 from logging.config import fileConfig
 
-from sqlalchemy import pool
+from sqlalchemy import pool, text
 from sqlalchemy.engine import Connection
 from sqlalchemy.ext.asyncio import async_engine_from_config
 
 from alembic import context
+from core.migrations import CHECKPOINT_TABLE
 from core.settings import settings
 from tenant.models import Base
+from tenant.partitions import PARTITION_NAME
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -55,8 +57,26 @@ def run_migrations_offline() -> None:
         context.run_migrations()
 
 
+def include_name(name, type_, parent_names) -> bool:
+    if type_ != "table":
+        return True
+    # The checkpoint table is created on demand by core.migrations.backfill, and member's
+    # partitions are managed by create_member_partitions; neither is part of the models.
+    return not (
+        name == CHECKPOINT_TABLE or name == "member_default" or PARTITION_NAME.match(name)
+    )
+
+
 def do_run_migrations(connection: Connection) -> None:
-    context.configure(connection=connection, target_metadata=target_metadata)
+    # DDL waiting for a lock blocks every query queued behind it, so give up quickly instead.
+    connection.execute(text(f"SET lock_timeout = {int(settings.MIGRATION_LOCK_TIMEOUT_MS)}"))
+    connection.commit()
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        include_name=include_name,
+        transaction_per_migration=True,
+    )
 
     with context.begin_transaction():
         context.run_migrations()
@@ -0,0 +1,66 @@
+"""single use tokens and unique members
+
+Revision ID: 27f1e175349f
+Revises: 3adc827a3b44
+Create Date: 2024-10-07 14:03:52.117640
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '27f1e175349f'
+down_revision: Union[str, None] = '3adc827a3b44'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('consumed_token',
+    sa.Column('jti', sa.String(length=32), nullable=False),
+    sa.Column('expires_at', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('jti')
+    )
+    op.create_index(op.f('ix_consumed_token_expires_at'), 'consumed_token', ['expires_at'], unique=False)
+
+    op.create_table('member_key',
+    sa.Column('org_id', sa.BigInteger(), nullable=False),
+    sa.Column('user_id', sa.BigInteger(), nullable=False),
+    sa.ForeignKeyConstraint(['org_id'], ['organisation.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('org_id', 'user_id')
+    )
+
+    # Replayed invites left duplicate memberships behind, keep the earliest one.
+    op.execute("""
+    DELETE FROM member m
+    USING member earlier
+    WHERE m.org_id = earlier.org_id
+      AND m.user_id = earlier.user_id
+      AND (earlier.created_at, earlier.id) < (m.created_at, m.id)
+    """)
+    op.execute('INSERT INTO member_key (org_id, user_id) SELECT org_id, user_id FROM member')
+
+    op.execute("""
+    CREATE FUNCTION release_member_key() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        DELETE FROM member_key WHERE org_id = OLD.org_id AND user_id = OLD.user_id;
+        RETURN OLD;
+    END
+    $$
+    """)
+    op.execute("""
+    CREATE TRIGGER member_release_key AFTER DELETE ON member
+    FOR EACH ROW EXECUTE FUNCTION release_member_key()
+    """)
+
+
+def downgrade() -> None:
+    op.execute('DROP TRIGGER member_release_key ON member')
+    op.execute('DROP FUNCTION release_member_key()')
+    op.drop_table('member_key')
+    op.drop_index(op.f('ix_consumed_token_expires_at'), table_name='consumed_token')
+    op.drop_table('consumed_token')
@@ -0,0 +1,121 @@
+"""partition member by created_at
+
+Revision ID: 3adc827a3b44
+Revises: 6d350ce090d2
+Create Date: 2024-10-02 10:15:21.804113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3adc827a3b44'
+down_revision: Union[str, None] = '6d350ce090d2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+CREATE_PARTITIONS_FUNCTION = """
+CREATE OR REPLACE FUNCTION create_member_partitions(from_month timestamptz, to_month timestamptz)
+RETURNS integer LANGUAGE plpgsql AS $$
+DECLARE
+    current_month timestamp := date_trunc('month', from_month AT TIME ZONE 'UTC');
+    final_month timestamp := date_trunc('month', to_month AT TIME ZONE 'UTC');
+    partition_name text;
+    created integer := 0;
+BEGIN
+    -- Workers call this on startup, serialise them so only one creates each partition.
+    PERFORM pg_advisory_xact_lock(hashtext('create_member_partitions'));
+    WHILE current_month <= final_month LOOP
+        partition_name := format('member_p%s', to_char(current_month, 'YYYY_MM'));
+        IF to_regclass(partition_name) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF member FOR VALUES FROM (%L) TO (%L)',
+                partition_name,
+                current_month AT TIME ZONE 'UTC',
+                (current_month + interval '1 month') AT TIME ZONE 'UTC'
+            );
+            created := created + 1;
+        END IF;
+        current_month := current_month + interval '1 month';
+    END LOOP;
+    RETURN created;
+END
+$$
+"""
+
+
+def upgrade() -> None:
+    op.execute('ALTER TABLE member RENAME TO member_unpartitioned')
+    op.execute('ALTER INDEX member_pkey RENAME TO member_unpartitioned_pkey')
+    op.execute('ALTER INDEX ix_member_id RENAME TO ix_member_unpartitioned_id')
+    op.execute('ALTER SEQUENCE member_id_seq OWNED BY NONE')
+
+    op.execute("""
+    CREATE TABLE member (
+        org_id BIGINT NOT NULL REFERENCES organisation (id) ON DELETE CASCADE,
+        user_id BIGINT NOT NULL REFERENCES "user" (id) ON DELETE CASCADE,
+        role_id BIGINT NOT NULL REFERENCES role (id) ON DELETE CASCADE,
+        id BIGINT NOT NULL DEFAULT nextval('member_id_seq'),
+        status INTEGER NOT NULL,
+        settings JSON NOT NULL,
+        created_at TIMESTAMP WITH TIME ZONE NOT NULL,
+        updated_at TIMESTAMP WITH TIME ZONE NOT NULL,
+        CONSTRAINT member_pkey PRIMARY KEY (id, created_at)
+    ) PARTITION BY RANGE (created_at)
+    """)
+    op.execute('ALTER SEQUENCE member_id_seq OWNED BY member.id')
+    op.create_index(op.f('ix_member_id'), 'member', ['id'], unique=False)
+    op.create_index(
+        op.f('ix_member_org_id_created_at'), 'member', ['org_id', 'created_at'], unique=False
+    )
+    # Catches rows outside every monthly partition so inserts never fail.
+    op.execute('CREATE TABLE member_default PARTITION OF member DEFAULT')
+
+    op.execute(CREATE_PARTITIONS_FUNCTION)
+    op.execute("""
+    SELECT create_member_partitions(
+        coalesce((SELECT min(created_at) FROM member_unpartitioned), now()),
+        now() + interval '3 months'
+    )
+    """)
+    op.execute("""
+    INSERT INTO member (org_id, user_id, role_id, id, status, settings, created_at, updated_at)
+    SELECT org_id, user_id, role_id, id, status, settings, created_at, updated_at
+    FROM member_unpartitioned
+    """)
+    op.drop_table('member_unpartitioned')
+
+
+def downgrade() -> None:
+    op.execute('ALTER TABLE member RENAME TO member_partitioned')
+    op.execute('ALTER INDEX member_pkey RENAME TO member_partitioned_pkey')
+    op.execute('ALTER INDEX ix_member_id RENAME TO ix_member_partitioned_id')
+    op.execute('ALTER SEQUENCE member_id_seq OWNED BY NONE')
+
+    op.create_table('member',
+    sa.Column('org_id', sa.BigInteger(), nullable=False),
+    sa.Column('user_id', sa.BigInteger(), nullable=False),
+    sa.Column('role_id', sa.BigInteger(), nullable=False),
+    sa.Column('id', sa.BigInteger(), server_default=sa.text("nextval('member_id_seq')"), nullable=False),
+    sa.Column('status', sa.Integer(), nullable=False),
+    sa.Column('settings', sa.JSON(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False),
+    sa.ForeignKeyConstraint(['org_id'], ['organisation.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['role_id'], ['role.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute('ALTER SEQUENCE member_id_seq OWNED BY member.id')
+    op.create_index(op.f('ix_member_id'), 'member', ['id'], unique=False)
+    op.execute("""
+    INSERT INTO member (org_id, user_id, role_id, id, status, settings, created_at, updated_at)
+    SELECT org_id, user_id, role_id, id, status, settings, created_at, updated_at
+    FROM member_partitioned
+    """)
+    op.drop_table('member_partitioned')
+    op.execute('DROP FUNCTION create_member_partitions(timestamptz, timestamptz)')
@@ -0,0 +1,115 @@
+"""move default member rows into new partitions
+
+Revision ID: b2d6e8a41c07
+Revises: fae3a219e004
+Create Date: 2024-10-21 09:12:37.508114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b2d6e8a41c07'
+down_revision: Union[str, None] = 'fae3a219e004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+CREATE_PARTITIONS_FUNCTION = """
+CREATE OR REPLACE FUNCTION create_member_partitions(from_month timestamptz, to_month timestamptz)
+RETURNS integer LANGUAGE plpgsql AS $$
+DECLARE
+    current_month timestamp := date_trunc('month', from_month AT TIME ZONE 'UTC');
+    final_month timestamp := date_trunc('month', to_month AT TIME ZONE 'UTC');
+    month_start timestamptz;
+    month_end timestamptz;
+    partition_name text;
+    created integer := 0;
+BEGIN
+    -- Workers call this on a schedule, serialise them so only one creates each partition.
+    PERFORM pg_advisory_xact_lock(hashtext('create_member_partitions'));
+    WHILE current_month <= final_month LOOP
+        partition_name := format('member_p%s', to_char(current_month, 'YYYY_MM'));
+        month_start := current_month AT TIME ZONE 'UTC';
+        month_end := (current_month + interval '1 month') AT TIME ZONE 'UTC';
+        IF to_regclass(partition_name) IS NULL THEN
+            IF EXISTS (
+                SELECT 1 FROM member_default
+                WHERE created_at >= month_start AND created_at < month_end
+            ) THEN
+                -- Rows that already landed in the default partition would violate the new
+                -- partition's bounds, so move them over while the default is detached.
+                CREATE TEMP TABLE member_moved AS
+                SELECT org_id, user_id, role_id, id, status, settings, created_at, updated_at
+                FROM member_default WHERE created_at >= month_start AND created_at < month_end;
+                ALTER TABLE member DETACH PARTITION member_default;
+                DELETE FROM member_default
+                WHERE created_at >= month_start AND created_at < month_end;
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF member FOR VALUES FROM (%L) TO (%L)',
+                    partition_name, month_start, month_end
+                );
+                INSERT INTO member (
+                    org_id, user_id, role_id, id, status, settings, created_at, updated_at
+                )
+                SELECT org_id, user_id, role_id, id, status, settings, created_at, updated_at
+                FROM member_moved;
+                -- The delete above may have fired member_release_key; the rows still exist.
+                INSERT INTO member_key (org_id, user_id)
+                SELECT org_id, user_id FROM member_moved ON CONFLICT DO NOTHING;
+                DROP TABLE member_moved;
+                ALTER TABLE member ATTACH PARTITION member_default DEFAULT;
+            ELSE
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF member FOR VALUES FROM (%L) TO (%L)',
+                    partition_name, month_start, month_end
+                );
+            END IF;
+            created := created + 1;
+        END IF;
+        current_month := current_month + interval '1 month';
+    END LOOP;
+    RETURN created;
+END
+$$
+"""
+
+PREVIOUS_PARTITIONS_FUNCTION = """
+CREATE OR REPLACE FUNCTION create_member_partitions(from_month timestamptz, to_month timestamptz)
+RETURNS integer LANGUAGE plpgsql AS $$
+DECLARE
+    current_month timestamp := date_trunc('month', from_month AT TIME ZONE 'UTC');
+    final_month timestamp := date_trunc('month', to_month AT TIME ZONE 'UTC');
+    partition_name text;
+    created integer := 0;
+BEGIN
+    -- Workers call this on startup, serialise them so only one creates each partition.
+    PERFORM pg_advisory_xact_lock(hashtext('create_member_partitions'));
+    WHILE current_month <= final_month LOOP
+        partition_name := format('member_p%s', to_char(current_month, 'YYYY_MM'));
+        IF to_regclass(partition_name) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF member FOR VALUES FROM (%L) TO (%L)',
+                partition_name,
+                current_month AT TIME ZONE 'UTC',
+                (current_month + interval '1 month') AT TIME ZONE 'UTC'
+            );
+            created := created + 1;
+        END IF;
+        current_month := current_month + interval '1 month';
+    END LOOP;
+    RETURN created;
+END
+$$
+"""
+
+
+def upgrade() -> None:
+    op.execute(CREATE_PARTITIONS_FUNCTION)
+
+
+def downgrade() -> None:
+    op.execute(PREVIOUS_PARTITIONS_FUNCTION)
@@ -0,0 +1,46 @@
+"""member sketch months
+
+Revision ID: c7e1f4a9d2b3
+Revises: b2d6e8a41c07
+Create Date: 2024-10-21 14:37:52.180447
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c7e1f4a9d2b3'
+down_revision: Union[str, None] = 'b2d6e8a41c07'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('member_sketch_month',
+    sa.Column('org_id', sa.BigInteger(), nullable=False),
+    sa.Column('role_id', sa.BigInteger(), nullable=False),
+    sa.Column('month', sa.Date(), nullable=False),
+    sa.Column('registers', sa.LargeBinary(), nullable=False),
+    sa.ForeignKeyConstraint(['org_id'], ['organisation.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['role_id'], ['role.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('org_id', 'role_id', 'month')
+    )
+    # Register-wise max of the daily sketches of each month.
+    op.execute("""
+    INSERT INTO member_sketch_month (org_id, role_id, month, registers)
+    SELECT org_id, role_id, month, decode(string_agg(lpad(to_hex(rank), 2, '0'), '' ORDER BY i), 'hex')
+    FROM (
+        SELECT org_id, role_id, date_trunc('month', day)::date AS month, i,
+            max(get_byte(registers, i)) AS rank
+        FROM member_sketch CROSS JOIN generate_series(0, 4095) AS i
+        GROUP BY 1, 2, 3, 4
+    ) registers
+    GROUP BY org_id, role_id, month
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('member_sketch_month')
@@ -0,0 +1,32 @@
+"""data version
+
+Revision ID: e4a19b7c0d52
+Revises: b84e0c5d2f17
+Create Date: 2024-10-14 16:40:08.221356
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4a19b7c0d52'
+down_revision: Union[str, None] = 'b84e0c5d2f17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(sa.schema.CreateSequence(sa.Sequence('data_version_seq')))
+    op.create_table('data_version',
+    sa.Column('org_id', sa.BigInteger(), nullable=False),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('org_id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('data_version')
+    op.execute(sa.schema.DropSequence(sa.Sequence('data_version_seq')))
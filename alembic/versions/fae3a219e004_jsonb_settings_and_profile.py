@@ -0,0 +1,53 @@
+"""jsonb settings and profile
+
+Revision ID: fae3a219e004
+Revises: e4a19b7c0d52
+Create Date: 2024-10-17 11:02:45.613920
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from core.migrations import create_index_concurrently, drop_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'fae3a219e004'
+down_revision: Union[str, None] = 'e4a19b7c0d52'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+COLUMNS = [
+    ('organisation', 'settings'),
+    ('user', 'settings'),
+    ('user', 'profile'),
+    ('member', 'settings'),
+]
+
+
+def upgrade() -> None:
+    for table, column in COLUMNS:
+        op.alter_column(table, column,
+               existing_type=sa.JSON(),
+               type_=postgresql.JSONB(astext_type=sa.Text()),
+               existing_nullable=False,
+               postgresql_using=f'{column}::jsonb')
+    create_index_concurrently(
+        'ix_organisation_settings', 'organisation', ['settings jsonb_path_ops'], using='gin'
+    )
+    create_index_concurrently('ix_user_profile', 'user', ['profile jsonb_path_ops'], using='gin')
+
+
+def downgrade() -> None:
+    drop_index_concurrently('ix_user_profile', 'user')
+    drop_index_concurrently('ix_organisation_settings', 'organisation')
+    for table, column in reversed(COLUMNS):
+        op.alter_column(table, column,
+               existing_type=postgresql.JSONB(astext_type=sa.Text()),
+               type_=sa.JSON(),
+               existing_nullable=False,
+               postgresql_using=f'{column}::json')
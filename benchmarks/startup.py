@@ -0,0 +1,75 @@
+"""Cold start benchmark.
+
+Imports `main` in a fresh interpreter and times the import and the first
+response served through the lifespan. Exits non-zero when the median of
+either measurement exceeds its budget.
+
+    python -m benchmarks.startup --runs 5 --max-import-ms 800 --max-first-response-ms 1500
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+PROBE = """
+import json, time
+from fastapi.testclient import TestClient
+
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+with TestClient(main.app) as client:
+    client.get("/openapi.json")
+    responded = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "first_response_ms": (responded - start) * 1000,
+}))
+"""
+
+
+def measure(runs: int) -> dict:
+    # Startup work that needs a live database is left out of the measurement.
+    env = {
+        **os.environ,
+        "WARM_DB_CONNECTIONS": "0",
+        "MEMBER_PARTITIONS_INTERVAL_HOURS": "0",
+        "RESUME_PURGES": "false",
+    }
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", PROBE], capture_output=True, text=True, check=True, env=env
+        )
+        samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return {key: statistics.median(s[key] for s in samples) for key in samples[0]}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-import-ms", type=float, default=800)
+    parser.add_argument("--max-first-response-ms", type=float, default=1500)
+    args = parser.parse_args()
+
+    result = measure(args.runs)
+    print(json.dumps(result, indent=2))
+
+    failed = False
+    if result["import_ms"] > args.max_import_ms:
+        print(f"import took {result['import_ms']:.1f} ms, budget {args.max_import_ms} ms")
+        failed = True
+    if result["first_response_ms"] > args.max_first_response_ms:
+        print(
+            f"first response took {result['first_response_ms']:.1f} ms, "
+            f"budget {args.max_first_response_ms} ms"
+        )
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
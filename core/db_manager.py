@@ -1,120 +1,302 @@
-from asyncio import current_task
+import asyncio
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from functools import lru_cache
 
-from sqlalchemy import select
+from sqlalchemy import bindparam, func, select, text, update
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
-from sqlalchemy.ext.asyncio.scoping import async_scoped_session
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.types import Text
 
 
 class DatabaseSessionManager:
-    def __init__(self, host, echo=False):
+    def __init__(
+        self, host, pool_size=10, query_cache_size=500, statement_cache_size=100, echo=False
+    ):
         self.engine = create_async_engine(
-            host, pool_size=10, max_overflow=0, pool_pre_ping=False, echo=echo
+            host,
+            pool_size=pool_size,
+            max_overflow=0,
+            pool_pre_ping=False,
+            echo=echo,
+            query_cache_size=query_cache_size,
+            connect_args={"prepared_statement_cache_size": statement_cache_size},
         )
         self.session_maker = async_sessionmaker(
             autocommit=False, autoflush=False, bind=self.engine, expire_on_commit=False
         )
-        self.session = async_scoped_session(self.session_maker, scopefunc=current_task)
 
     async def close(self):
         if self.engine is None:
             raise SQLAlchemyError("DatabaseSessionManager is not initialized")
         await self.engine.dispose()
 
+    async def warm_up(self, connections: int):
+        async def ping():
+            async with self.engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
 
-class DatabaseManager:
+        connections = min(connections, self.engine.pool.size())
+        await asyncio.gather(*(ping() for _ in range(connections)))
 
-    def __init__(self, host: str) -> None:
-        self.db = DatabaseSessionManager(host=host)
-        self._model = None
-        self.session = self.db.session()
 
-    def model(self, model):
-        self._model = model
-        return self
+@lru_cache
+def get_session_manager(host: str, **options) -> DatabaseSessionManager:
+    # One engine (and connection pool) per process; requests only get their own session.
+    return DatabaseSessionManager(host=host, **options)
 
-    async def create(self, **payload):
+
+current_session: ContextVar[AsyncSession] = ContextVar("current_session", default=None)
+
+
+@asynccontextmanager
+async def session_scope(manager: DatabaseSessionManager):
+    """Open a session and make it the implicit one for repositories until the block exits."""
+    async with manager.session_maker() as session:
+        token = current_session.set(session)
+        try:
+            yield session
+        finally:
+            current_session.reset(token)
+
+
+def resolve_session(session=None) -> AsyncSession:
+    """Return `session`, or the one bound by session_scope when none is given."""
+    if session is None:
+        session = current_session.get()
+    if session is None:
+        raise SQLAlchemyError("No database session given or bound to the current context")
+    return session
+
+
+def split_payload(payload: dict):
+    """Separate column filters from key-path filters such as `settings__theme="dark"`.
+
+    Key paths on the same column are folded into one document, so they can be matched
+    with a single `@>` that the column's GIN index answers.
+    """
+    columns, documents = {}, {}
+    for key, value in payload.items():
+        column, _, path = key.partition("__")
+        if not path:
+            columns[key] = value
+            continue
+        document = documents.setdefault(column, {})
+        *parents, leaf = path.split("__")
+        for parent in parents:
+            document = document.setdefault(parent, {})
+        document[leaf] = value
+    return columns, documents
+
+
+def filter_clauses(model, payload: dict):
+    columns, documents = split_payload(payload)
+    clauses = [
+        getattr(model, key).is_(None) if value is None else getattr(model, key) == value
+        for key, value in columns.items()
+    ]
+    clauses += [getattr(model, column).contains(document) for column, document in documents.items()]
+    return clauses
+
+
+@lru_cache(maxsize=256)
+def lookup_statement(model, keys: tuple, paths: tuple = ()):
+    # Reusing one statement object per (model, filter keys) shape lets SQLAlchemy memoize
+    # its cache key, so repeated lookups skip construction and cache key generation.
+    return select(model).where(
+        *(getattr(model, key) == bindparam(key) for key in keys),
+        *(getattr(model, column).contains(bindparam(f"{column}__")) for column in paths),
+    )
+
+
+def filter_statement(model, payload: dict):
+    if any(value is None for value in payload.values()):
+        # "key = :key" with NULL never matches, filter_clauses renders "IS NULL" instead.
+        return select(model).where(*filter_clauses(model, payload)), {}
+    columns, documents = split_payload(payload)
+    params = {**columns, **{f"{column}__": document for column, document in documents.items()}}
+    return lookup_statement(model, tuple(sorted(columns)), tuple(sorted(documents))), params
+
+
+def overlapping_paths(paths):
+    """Return a pair of key paths where one equals or contains the other, or None."""
+    paths = sorted(tuple(path) for path in paths)
+    for shorter, longer in zip(paths, paths[1:]):
+        if longer[: len(shorter)] == shorter:
+            return shorter, longer
+    return None
+
+
+class Repository:
+    """Data access for one model.
+
+    Holds no per-request state, so a single instance per model is shared by the whole
+    process. Every operation uses the session it is given, or the one bound by
+    `session_scope` when called without one.
+    """
+
+    __slots__ = ("_model",)
+
+    def __init__(self, model) -> None:
+        object.__setattr__(self, "_model", model)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    @property
+    def model(self):
+        return self._model
+
+    _session = staticmethod(resolve_session)
+
+    async def create(self, session=None, **payload):
+        session = self._session(session)
         instance = self._model(**payload)
-        self.session.add(instance)
-        await self.session.commit()
-        await self.session.refresh(instance)
+        session.add(instance)
+        await session.commit()
+        await session.refresh(instance)
         return instance
 
-    async def create_instance(self, **payload):
+    async def create_instance(self, session=None, **payload):
+        session = self._session(session)
         instance = self._model(**payload)
-        self.session.add(instance)
-        await self.session.flush()
+        session.add(instance)
+        await session.flush()
         return instance
 
-    async def add(self, instance):
-        self.session.add(instance)
-        await self.session.commit()
-        await self.session.refresh(instance)
+    async def add(self, instance, session=None):
+        session = self._session(session)
+        session.add(instance)
+        await session.commit()
+        await session.refresh(instance)
 
-    async def bulk_create(self, *instances):
-        self.session.add_all(*instances)
-        await self.session.commit()
+    async def bulk_create(self, *instances, session=None):
+        session = self._session(session)
+        session.add_all(*instances)
+        await session.commit()
 
-    async def update(self, **payload):
-        instance = await self.get(id=payload.get("id"))
+    async def update(self, session=None, **payload):
+        session = self._session(session)
+        instance = await self.get(session, id=payload.get("id"))
         for k, v in payload.items():
             setattr(instance, k, v)
-        await self.session.commit()
-        await self.session.refresh(instance)
+        await session.commit()
+        await session.refresh(instance)
         return instance
 
-    async def delete(self, **payload):
-        instance = await self.get(id=payload.get("id"))
-        await self.session.delete(instance)
-        await self.session.commit()
+    async def delete(self, session=None, **payload):
+        session = self._session(session)
+        instance = await self.get(session, id=payload.get("id"))
+        await session.delete(instance)
+        await session.commit()
 
-    async def authenticate(self, **payload):
+    async def authenticate(self, session=None, **payload):
+        session = self._session(session)
         username = None
         if "email" in payload:
             username = payload["email"]
         else:
             raise KeyError("email or username required to authenticate")
-        user = await self.get(email=username)
+        user = await self.get(session, email=username)
         if user.verify_password(payload["password"]):
+            if session.is_modified(user):
+                await session.commit()
             return user
         return None
 
-    async def get(self, **payload):
-        instance = await self.session.execute(select(self._model).filter_by(**payload))
+    async def get(self, session=None, **payload):
+        session = self._session(session)
+        instance = await session.execute(*filter_statement(self._model, payload))
         return instance.one()[0]
 
-    async def get_or_none(self, **payload):
-        instances = await self.session.execute(select(self._model).filter_by(**payload))
+    async def get_or_none(self, session=None, **payload):
+        session = self._session(session)
+        instances = await session.execute(*filter_statement(self._model, payload))
         instance = instances.unique().one_or_none()
         if not instance:
             return None
         return instance[0]
 
-    async def get_or_create(self, **payload):
-        instance = await self.get_or_none(**payload)
+    async def get_or_create(self, session=None, **payload):
+        session = self._session(session)
+        instance = await self.get_or_none(session, **payload)
         if instance:
             return instance
-        instance = await self.create(**payload)
+        instance = await self.create(session, **payload)
         return instance
 
-    async def get_or_create_instance(self, **payload):
-        instance = await self.get_or_none(**payload)
+    async def get_or_create_instance(self, session=None, **payload):
+        session = self._session(session)
+        instance = await self.get_or_none(session, **payload)
         if instance:
             return instance
-        instance = await self.create_instance(**payload)
+        instance = await self.create_instance(session, **payload)
         return instance
 
-    async def filter(self, **payload):
-        instance_list = await self.session.execute(select(self._model).filter_by(**payload))
+    async def filter(self, session=None, **payload):
+        session = self._session(session)
+        instance_list = await session.execute(*filter_statement(self._model, payload))
         instance_list = instance_list.unique().all()
         instances = [obj[0] for obj in instance_list]
         return instances
 
-    async def all(self):
-        instance_list = await self.session.execute(select(self._model))
+    async def all(self, session=None):
+        session = self._session(session)
+        instance_list = await session.execute(select(self._model))
         instance_list = instance_list.unique().all()
         instances = [obj[0] for obj in instance_list]
         return instances
 
-    async def save(self):
-        await self.session.commit()
+    async def patch_json(self, session=None, column="settings", changes=None, remove=(), **payload):
+        """Change keys of a JSONB column in place with one UPDATE, without reading it first.
+
+        `changes` maps key paths (tuples) to new values and `remove` lists key paths to
+        drop. Top-level keys are merged with `||`, nested ones are written with
+        `jsonb_set` after any missing parent objects are created. Paths must not overlap,
+        as the later step would silently undo the earlier one. Returns the new document,
+        or None when no row matches `payload`.
+        """
+        session = self._session(session)
+        target = getattr(self._model, column)
+        changes = {tuple(path): value for path, value in (changes or {}).items()}
+        remove = [tuple(keys) for keys in remove]
+        overlap = overlapping_paths([*changes, *remove])
+        if overlap:
+            raise ValueError(f"Key paths {overlap[0]} and {overlap[1]} overlap")
+
+        def path(keys):
+            return bindparam(None, list(keys), type_=ARRAY(Text))
+
+        def document(value):
+            return bindparam(None, value, type_=JSONB)
+
+        # Parents are filled from the stored document rather than from the expression built
+        # so far, which keeps the statement linear in the number of paths.
+        value = target
+        parents = sorted({keys[:i] for keys in changes for i in range(1, len(keys))}, key=len)
+        for keys in parents:
+            existing = target.op("#>", return_type=JSONB)(path(keys))
+            value = func.jsonb_set(
+                value, path(keys), func.coalesce(existing, document({})), True, type_=JSONB
+            )
+        top = {keys[0]: v for keys, v in changes.items() if len(keys) == 1}
+        if top:
+            value = value.op("||", return_type=JSONB)(document(top))
+        for keys, v in changes.items():
+            if len(keys) > 1:
+                value = func.jsonb_set(value, path(keys), document(v), True, type_=JSONB)
+        for keys in remove:
+            value = value.op("#-", return_type=JSONB)(path(keys))
+
+        query = (
+            update(self._model)
+            .where(*filter_clauses(self._model, payload))
+            .values({column: value})
+            .returning(target)
+            .execution_options(synchronize_session=False)
+        )
+        result = await session.execute(query)
+        patched = result.scalar_one_or_none()
+        await session.commit()
+        return patched
@@ -0,0 +1,38 @@
+import math
+from hashlib import blake2b
+
+PRECISION = 12
+REGISTERS = 1 << PRECISION
+RELATIVE_ERROR = 1.04 / math.sqrt(REGISTERS)
+
+
+def register_for(value) -> tuple:
+    """Return the (register index, rank) a value updates in a HyperLogLog sketch."""
+    h = int.from_bytes(blake2b(str(value).encode(), digest_size=8).digest(), "big")
+    index = h >> (64 - PRECISION)
+    rest = h & ((1 << (64 - PRECISION)) - 1)
+    return index, (64 - PRECISION) - rest.bit_length() + 1
+
+
+class HyperLogLog:
+
+    def __init__(self, registers: bytes = None):
+        self.registers = bytearray(registers or REGISTERS)
+
+    def add(self, value):
+        index, rank = register_for(value)
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog | bytes"):
+        other = other.registers if isinstance(other, HyperLogLog) else other
+        self.registers = bytearray(map(max, self.registers, other))
+        return self
+
+    def count(self) -> int:
+        alpha = 0.7213 / (1 + 1.079 / REGISTERS)
+        estimate = alpha * REGISTERS**2 / sum(2.0**-r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * REGISTERS and zeros:
+            estimate = REGISTERS * math.log(REGISTERS / zeros)
+        return round(estimate)
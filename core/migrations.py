@@ -0,0 +1,241 @@
+import logging
+import time
+
+from alembic import op
+from sqlalchemy import text
+
+from core.settings import settings
+
+# A child of the "alembic" logger, so progress is printed along with alembic's own output.
+logger = logging.getLogger("alembic.online")
+
+CHECKPOINT_TABLE = "migration_checkpoint"
+
+CREATE_CHECKPOINTS = f"""
+CREATE TABLE IF NOT EXISTS {CHECKPOINT_TABLE} (
+    name text PRIMARY KEY,
+    position jsonb NOT NULL,
+    updated bigint NOT NULL,
+    updated_at timestamptz NOT NULL
+)
+"""
+
+
+def _connection():
+    if op.get_context().as_sql:
+        raise RuntimeError("Online migration helpers need a live connection, not --sql mode")
+    return op.get_bind()
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _is_partitioned(conn, table: str) -> bool:
+    query = text("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:table)")
+    return bool(conn.execute(query, {"table": _quote(table)}).scalar())
+
+
+def _partitions(conn, table: str):
+    query = text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:table) ORDER BY c.relname"
+    )
+    return conn.execute(query, {"table": _quote(table)}).scalars().all()
+
+
+def _index_sql(name, table, columns, using, where, unique, concurrently=True, only=False):
+    return (
+        f"CREATE {'UNIQUE ' if unique else ''}INDEX {'CONCURRENTLY ' if concurrently else ''}"
+        f"IF NOT EXISTS {_quote(name)} ON {'ONLY ' if only else ''}{_quote(table)} "
+        f"USING {using} ({', '.join(columns)})" + (f" WHERE {where}" if where else "")
+    )
+
+
+def _build_concurrently(conn, name: str, sql: str):
+    # A failed concurrent build leaves an INVALID index behind that IF NOT EXISTS would keep.
+    query = text("SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)")
+    if conn.execute(query, {"name": _quote(name)}).scalar():
+        logger.info("Dropping invalid index %s left by an earlier attempt", name)
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {_quote(name)}"))
+    # Concurrent builds wait for older transactions through locks, which lock_timeout would
+    # turn into a failure whenever a long transaction is running.
+    lock_timeout = conn.execute(text("SHOW lock_timeout")).scalar()
+    conn.execute(text("SET lock_timeout = 0"))
+    try:
+        started = time.monotonic()
+        conn.execute(text(sql))
+        logger.info("Built index %s in %.1fs", name, time.monotonic() - started)
+    finally:
+        conn.execute(
+            text("SELECT set_config('lock_timeout', :value, false)"), {"value": lock_timeout}
+        )
+
+
+def create_index_concurrently(
+    name: str, table: str, columns, using: str = "btree", where: str = None, unique=False
+):
+    """Create an index without blocking writes; `columns` are SQL expressions.
+
+    Runs outside the migration transaction. Partitioned tables cannot be indexed
+    concurrently, so the index is created on the parent only and each partition's
+    index is built concurrently and attached, which validates the parent index.
+    Safe to re-run after an interruption.
+    """
+    with op.get_context().autocommit_block():
+        conn = _connection()
+        if not _is_partitioned(conn, table):
+            _build_concurrently(conn, name, _index_sql(name, table, columns, using, where, unique))
+            return
+        conn.execute(text(_index_sql(name, table, columns, using, where, unique, False, only=True)))
+        for partition in _partitions(conn, table):
+            child = f"{partition}_{name}"[:63]
+            sql = _index_sql(child, partition, columns, using, where, unique)
+            _build_concurrently(conn, child, sql)
+            conn.execute(text(f"ALTER INDEX {_quote(name)} ATTACH PARTITION {_quote(child)}"))
+
+
+def drop_index_concurrently(name: str, table: str):
+    with op.get_context().autocommit_block():
+        conn = _connection()
+        if _is_partitioned(conn, table):
+            # Not supported concurrently for partitioned indexes; lock_timeout bounds the wait.
+            conn.execute(text(f"DROP INDEX IF EXISTS {_quote(name)}"))
+        else:
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {_quote(name)}"))
+
+
+def replication_lag_ms(conn):
+    """Replay lag of the slowest replica, 0 without replicas, None if this role cannot see it."""
+    # replay_lag is only visible to superusers and pg_monitor members; otherwise it is NULL.
+    if not conn.execute(text("SELECT pg_has_role('pg_monitor', 'USAGE')")).scalar():
+        return None
+    query = text(
+        "SELECT coalesce(max(extract(epoch FROM replay_lag)) * 1000, 0) FROM pg_stat_replication"
+    )
+    return float(conn.execute(query).scalar())
+
+
+def wait_for_replicas(conn, max_lag_ms: float):
+    while max_lag_ms:
+        lag = replication_lag_ms(conn)
+        if lag is None:
+            raise RuntimeError(
+                "Replication lag is not visible to this role; grant it pg_monitor "
+                "or set MIGRATION_MAX_LAG_MS=0 to run without the check"
+            )
+        if lag <= max_lag_ms:
+            return
+        logger.info("Replication lag %.0fms is above %.0fms, waiting", lag, max_lag_ms)
+        time.sleep(min(lag, 5000) / 1000)
+
+
+def _backfill_sql(table, key, key_types, assignments, where, resume: bool):
+    keys = ", ".join(_quote(column) for column in key)
+    last = ", ".join(f"(position ->> {i})::{key_types[column]}" for i, column in enumerate(key))
+    after = (
+        f"WHERE ({keys}) > (SELECT {last} FROM {CHECKPOINT_TABLE} WHERE name = :name)"
+        if resume
+        else ""
+    )
+    descending = ", ".join(f"{_quote(column)} DESC" for column in key)
+    return f"""
+    WITH bounds AS (
+        SELECT {keys} FROM {_quote(table)} {after} ORDER BY {keys} LIMIT :batch_size
+    ),
+    batch AS (
+        UPDATE {_quote(table)} SET {assignments}
+        WHERE ({keys}) IN (SELECT {keys} FROM bounds) AND ({where or 'true'})
+        RETURNING 1
+    ),
+    saved AS (
+        INSERT INTO {CHECKPOINT_TABLE} (name, position, updated, updated_at)
+        SELECT :name, jsonb_build_array({keys}), (SELECT count(*) FROM batch), now()
+        FROM (SELECT {keys} FROM bounds ORDER BY {descending} LIMIT 1) upper
+        ON CONFLICT (name) DO UPDATE SET
+            position = excluded.position,
+            updated = {CHECKPOINT_TABLE}.updated + excluded.updated,
+            updated_at = excluded.updated_at
+        RETURNING updated
+    )
+    SELECT (SELECT count(*) FROM bounds), (SELECT updated FROM saved)
+    """
+
+
+def backfill(
+    name: str,
+    table: str,
+    assignments: str,
+    key=("id",),
+    where: str = None,
+    batch_size: int = None,
+    batch_ms: float = None,
+    max_lag_ms: float = None,
+    duty_cycle: float = None,
+):
+    """Run `UPDATE table SET assignments` in small batches walked in `key` order.
+
+    Each batch commits on its own, together with its position under `name` in the
+    checkpoint table, so a rerun continues after the last finished batch. The batch
+    size adapts to take about `batch_ms`, batches run for at most `duty_cycle` of the
+    time, and no batch starts while replicas lag more than `max_lag_ms`. `where`
+    limits the rows that are updated, e.g. "col IS NULL".
+    """
+    batch_size = batch_size or settings.MIGRATION_BATCH_SIZE
+    batch_ms = settings.MIGRATION_BATCH_MS if batch_ms is None else batch_ms
+    max_lag_ms = settings.MIGRATION_MAX_LAG_MS if max_lag_ms is None else max_lag_ms
+    duty_cycle = min(duty_cycle or settings.MIGRATION_DUTY_CYCLE, 1)
+    max_batch_size = batch_size * 10
+
+    with op.get_context().autocommit_block():
+        conn = _connection()
+        conn.execute(text(CREATE_CHECKPOINTS))
+        key_types = {
+            column: conn.execute(
+                text(
+                    "SELECT format_type(atttypid, atttypmod) FROM pg_attribute "
+                    "WHERE attrelid = to_regclass(:table) AND attname = :column"
+                ),
+                {"table": _quote(table), "column": column},
+            ).scalar_one()
+            for column in key
+        }
+        done = conn.execute(
+            text(f"SELECT updated FROM {CHECKPOINT_TABLE} WHERE name = :name"), {"name": name}
+        ).scalar()
+        if done is not None:
+            logger.info("Resuming backfill %s after %d row(s)", name, done)
+        first, rest = (
+            text(_backfill_sql(table, key, key_types, assignments, where, after))
+            for after in (False, True)
+        )
+
+        initial = done or 0
+        started = reported = time.monotonic()
+        while True:
+            wait_for_replicas(conn, max_lag_ms)
+            batch_started = time.monotonic()
+            scanned, saved = conn.execute(
+                first if done is None else rest, {"name": name, "batch_size": batch_size}
+            ).one()
+            done = done if saved is None else saved
+            elapsed_ms = (time.monotonic() - batch_started) * 1000
+            if scanned < batch_size:
+                break
+            if batch_ms and elapsed_ms > batch_ms:
+                batch_size = max(batch_size // 2, 100)
+            elif batch_ms and elapsed_ms < batch_ms / 2:
+                batch_size = min(batch_size * 2, max_batch_size)
+            if time.monotonic() - reported >= 10:
+                reported = time.monotonic()
+                rate = (done - initial) / (reported - started)
+                logger.info(
+                    "Backfill %s: %d row(s), %.0f/s, batch %d", name, done, rate, batch_size
+                )
+            # Leave the primary idle between batches in proportion to the work just done.
+            time.sleep(elapsed_ms / 1000 * (1 - duty_cycle) / duty_cycle)
+
+        conn.execute(text(f"DELETE FROM {CHECKPOINT_TABLE} WHERE name = :name"), {"name": name})
+        logger.info(
+            "Backfill %s finished: %d row(s) in %.1fs", name, done or 0, time.monotonic() - started
+        )
@@ -1,3 +1,5 @@
+from typing import Optional
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -13,5 +15,56 @@ class Settings(BaseSettings):
     EMAIL_KEY: str
     EMAIL_USER: str
 
+    DB_POOL_SIZE: int = 10
+    DB_CONNECTION_BUDGET: int = 0
+    DB_RESERVED_CONNECTIONS: int = 10
+    DB_QUERY_CACHE_SIZE: int = 500
+    DB_STATEMENT_CACHE_SIZE: int = 100
+    WARM_DB_CONNECTIONS: int = 0
+    WARM_HASH_CONTEXT: bool = True
+    MEMBER_PARTITIONS_AHEAD: int = 3
+    MEMBER_PARTITIONS_INTERVAL_HOURS: float = 6
+    CONSUMED_TOKEN_LRU_SIZE: int = 10_000
+
+    ARGON2_TIME_COST: Optional[int] = None
+    ARGON2_MEMORY_COST: Optional[int] = None
+    ARGON2_PARALLELISM: Optional[int] = None
+
+    STATS_MAX_AGE: int = 0
+
+    PURGE_CHUNK_SIZE: int = 1000
+    PURGE_PAUSE_MS: int = 50
+    RESUME_PURGES: bool = True
+
+    IMPORT_BATCH_SIZE: int = 5000
+    IMPORT_HASH_WORKERS: int = 0
+
+    MIGRATION_LOCK_TIMEOUT_MS: int = 5000
+    MIGRATION_BATCH_SIZE: int = 5000
+    MIGRATION_BATCH_MS: float = 500
+    MIGRATION_MAX_LAG_MS: float = 1000
+    MIGRATION_DUTY_CYCLE: float = 0.5
+
+    TRACE_SAMPLE_RATE: float = 0.0
+    TRACE_SLOW_MS: float = 0.0
+    TRACE_FILE: str = ""
+    TRACE_OTLP_ENDPOINT: str = ""
+
+    SERVER_HOST: str = "0.0.0.0"
+    SERVER_PORT: int = 8000
+    SERVER_WORKERS: int = 0
+    SERVER_INSTANCES: int = 1
+    SERVER_BACKLOG: int = 2048
+    SERVER_KEEP_ALIVE: int = 5
+    SERVER_GRACEFUL_TIMEOUT: int = 30
+
+    @property
+    def db_options(self):
+        return {
+            "pool_size": self.DB_POOL_SIZE,
+            "query_cache_size": self.DB_QUERY_CACHE_SIZE,
+            "statement_cache_size": self.DB_STATEMENT_CACHE_SIZE,
+        }
+
 
 settings = Settings()
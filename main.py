@@ -1,8 +1,65 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI
+from sqlalchemy.orm import configure_mappers
+
 from core.app import create_app
+from core.db_manager import get_session_manager, session_scope
+from core.settings import settings
+from core.tracing import Exporter, Tracer, TracingMiddleware, instrument_engine
+from tenant.partitions import maintain_member_partitions
+from tenant.passwords import get_pwd_context
+from tenant.purge import resume_purges
 from tenant.routes import user
 from tenant.routes_stats import statistics
 
-app = create_app(title="Tenant")
+
+tracer = Tracer(
+    sample_rate=settings.TRACE_SAMPLE_RATE,
+    slow_ms=settings.TRACE_SLOW_MS,
+    exporter=(
+        Exporter(path=settings.TRACE_FILE, endpoint=settings.TRACE_OTLP_ENDPOINT)
+        if settings.TRACE_FILE or settings.TRACE_OTLP_ENDPOINT
+        else None
+    ),
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    db = get_session_manager(settings.DB_URL, **settings.db_options)
+    configure_mappers()
+    if tracer.enabled:
+        instrument_engine(db.engine)
+    if settings.WARM_DB_CONNECTIONS:
+        await db.warm_up(settings.WARM_DB_CONNECTIONS)
+    if settings.WARM_HASH_CONTEXT:
+        get_pwd_context().hash("warm-up")
+    partitions = None
+    if settings.MEMBER_PARTITIONS_INTERVAL_HOURS:
+        partitions = asyncio.create_task(
+            maintain_member_partitions(
+                db,
+                settings.MEMBER_PARTITIONS_AHEAD,
+                settings.MEMBER_PARTITIONS_INTERVAL_HOURS * 3600,
+            )
+        )
+    if settings.RESUME_PURGES:
+        async with session_scope(db):
+            await resume_purges()
+    yield
+    if partitions:
+        partitions.cancel()
+    await db.close()
+    if tracer.enabled:
+        tracer.exporter.close()
+
+
+app = create_app(title="Tenant", lifespan=lifespan)
+
+if tracer.enabled:
+    app.add_middleware(TracingMiddleware, tracer=tracer)
 
 app.include_router(router=user)
 app.include_router(router=statistics)
@@ -0,0 +1,83 @@
+import argparse
+import asyncio
+import os
+from importlib.util import find_spec
+
+import uvicorn
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+
+from core.settings import settings
+
+
+async def max_connections() -> int:
+    engine = create_async_engine(settings.DB_URL, poolclass=NullPool)
+    try:
+        async with engine.connect() as conn:
+            return int((await conn.execute(text("SHOW max_connections"))).scalar())
+    finally:
+        await engine.dispose()
+
+
+def connection_budget() -> int:
+    """Connections the workers may hold: max_connections less those reserved for other clients."""
+    try:
+        limit = asyncio.run(max_connections())
+    except Exception as e:
+        raise SystemExit(f"Cannot read max_connections ({e}), set DB_CONNECTION_BUDGET instead")
+    # Every app instance runs this, so each may only claim its share of the server.
+    budget = (limit - settings.DB_RESERVED_CONNECTIONS) // settings.SERVER_INSTANCES
+    print(
+        f"DB connection budget {budget}: max_connections {limit} less the reserved ones, "
+        f"shared by {settings.SERVER_INSTANCES} instance(s)"
+    )
+    return budget
+
+
+def pool_size_per_worker(workers: int, budget: int) -> int:
+    if budget < workers:
+        raise SystemExit(
+            f"DB connection budget {budget} is smaller than the {workers} workers requested"
+        )
+    return budget // workers
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Tenant API with uvicorn workers")
+    parser.add_argument("--host", default=settings.SERVER_HOST)
+    parser.add_argument("--port", type=int, default=settings.SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=settings.SERVER_WORKERS or os.cpu_count())
+    parser.add_argument("--db-budget", type=int, default=settings.DB_CONNECTION_BUDGET)
+    parser.add_argument("--backlog", type=int, default=settings.SERVER_BACKLOG)
+    parser.add_argument("--keep-alive", type=int, default=settings.SERVER_KEEP_ALIVE)
+    parser.add_argument("--graceful-timeout", type=int, default=settings.SERVER_GRACEFUL_TIMEOUT)
+    args = parser.parse_args()
+
+    pool_size = pool_size_per_worker(args.workers, args.db_budget or connection_budget())
+    # Spawned workers build their own Settings from the environment; a single worker runs
+    # in this process, where settings already exist.
+    os.environ["DB_POOL_SIZE"] = str(pool_size)
+    settings.DB_POOL_SIZE = pool_size
+    print(
+        f"Starting {args.workers} worker(s) with {pool_size} DB connection(s) each, "
+        f"{args.workers * pool_size} in total"
+    )
+
+    # uvicorn drains in-flight requests on SIGTERM, then runs the lifespan shutdown.
+    uvicorn.run(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        loop="uvloop" if find_spec("uvloop") else "asyncio",
+        http="httptools",
+        backlog=args.backlog,
+        timeout_keep_alive=args.keep_alive,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        proxy_headers=True,
+    )
+
+
+if __name__ == "__main__":
+    main()
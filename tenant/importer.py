@@ -0,0 +1,303 @@
+import argparse
+import asyncio
+import csv
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from sqlalchemy import func, select, text
+
+from core.db_manager import get_session_manager
+from core.settings import settings
+
+from .partitions import create_member_partitions
+from .passwords import argon2_params, get_pwd_context, use_argon2_params
+from .sketches import record_memberships
+from .versions import bump_version
+
+FIELDS = ("email", "password", "org", "role")
+LIMITS = {"email": 100, "org": 50, "role": 50}
+
+STAGING = """
+CREATE TEMP TABLE IF NOT EXISTS import_row (
+    line bigint NOT NULL,
+    email text NOT NULL,
+    password text NOT NULL,
+    org text NOT NULL,
+    role text NOT NULL,
+    org_id bigint,
+    role_id bigint,
+    user_id bigint
+) ON COMMIT DELETE ROWS
+"""
+
+# Organisations are matched by name like /signUp does; the lowest id wins if a name repeats.
+MERGE_ORGANISATIONS = """
+INSERT INTO organisation (name, personal, status, settings, created_at, updated_at)
+SELECT DISTINCT s.org, false, 0, '{}', now(), now() FROM import_row s
+WHERE NOT EXISTS (SELECT 1 FROM organisation o WHERE o.name = s.org AND o.status = 0)
+"""
+
+RESOLVE_ORGANISATIONS = """
+UPDATE import_row s SET org_id = o.id
+FROM (
+    SELECT name, min(id) AS id FROM organisation
+    WHERE status = 0 AND name IN (SELECT org FROM import_row) GROUP BY name
+) o
+WHERE o.name = s.org
+"""
+
+MERGE_ROLES = """
+INSERT INTO role (name, org_id)
+SELECT DISTINCT s.role, s.org_id FROM import_row s
+WHERE NOT EXISTS (SELECT 1 FROM role r WHERE r.org_id = s.org_id AND r.name = s.role)
+"""
+
+RESOLVE_ROLES = """
+UPDATE import_row s SET role_id = r.id
+FROM (
+    SELECT org_id, name, min(id) AS id FROM role
+    WHERE org_id IN (SELECT org_id FROM import_row) GROUP BY org_id, name
+) r
+WHERE r.org_id = s.org_id AND r.name = s.role
+"""
+
+# Existing users keep their password; only their memberships are added.
+MERGE_USERS = """
+INSERT INTO "user" (email, password, profile, status, settings, created_at, updated_at)
+SELECT DISTINCT ON (email) email, password, '{}', 0, '{}', now(), now() FROM import_row
+ORDER BY email, line
+ON CONFLICT (email) DO NOTHING
+"""
+
+RESOLVE_USERS = """
+UPDATE import_row s SET user_id = u.id FROM "user" u WHERE u.email = s.email
+"""
+
+# Same claim-then-insert as add_member, with the first row winning for repeated pairs.
+MERGE_MEMBERS = """
+WITH claimed AS (
+    INSERT INTO member_key (org_id, user_id)
+    SELECT DISTINCT org_id, user_id FROM import_row
+    ON CONFLICT DO NOTHING
+    RETURNING org_id, user_id
+)
+INSERT INTO member (org_id, user_id, role_id, status, settings, created_at, updated_at)
+SELECT c.org_id, c.user_id, first.role_id, 0, '{}', now(), now()
+FROM claimed c
+CROSS JOIN LATERAL (
+    SELECT s.role_id FROM import_row s
+    WHERE s.org_id = c.org_id AND s.user_id = c.user_id
+    ORDER BY s.line LIMIT 1
+) first
+RETURNING org_id, role_id, user_id
+"""
+
+
+def read_records(path: str, fmt: str):
+    """Yield (record number, row dict) pairs from a CSV file with a header or from NDJSON."""
+    with open(path, newline="", encoding="utf-8") as f:
+        if fmt == "csv":
+            yield from enumerate(csv.DictReader(f), start=1)
+        else:
+            records = (json.loads(line) for line in f if line.strip())
+            yield from enumerate(records, start=1)
+
+
+def validate(line: int, record: dict):
+    row = {field: str(record.get(field) or "").strip() for field in FIELDS}
+    missing = [field for field in FIELDS if not row[field]]
+    if missing:
+        return None, f"record {line}: missing {', '.join(missing)}"
+    too_long = [field for field, limit in LIMITS.items() if len(row[field]) > limit]
+    if too_long:
+        return None, f"record {line}: {', '.join(too_long)} too long"
+    return (line, row["email"], row["password"], row["org"], row["role"]), None
+
+
+def read_batches(path: str, fmt: str, batch_size: int, skip: int = 0):
+    """Yield (last record number, valid rows, rejections) per `batch_size` records."""
+    records = islice(read_records(path, fmt), skip, None)
+    while True:
+        chunk = list(islice(records, batch_size))
+        if not chunk:
+            return
+        rows, rejected = [], []
+        for line, record in chunk:
+            row, error = validate(line, record)
+            if row:
+                rows.append(row)
+            else:
+                rejected.append(error)
+        yield chunk[-1][0], rows, rejected
+
+
+def init_worker(params: dict):
+    # Workers hash with exactly the parent's parameters, whatever the start method.
+    use_argon2_params(**params)
+
+
+def hash_rows(rows):
+    """Hash plain passwords; values that already are argon2 hashes are kept as they are.
+
+    Returns the hashed rows and the rejections for hashes that do not parse, which
+    would otherwise fail on the user's first login.
+    """
+    from passlib.hash import argon2
+
+    context = get_pwd_context()
+    hashed, rejected = [], []
+    for line, email, password, *rest in rows:
+        if password.startswith("$argon2"):
+            try:
+                argon2.from_string(password)
+            except ValueError:
+                rejected.append(f"record {line}: malformed argon2 hash")
+                continue
+        else:
+            password = context.hash(password)
+        hashed.append((line, email, password, *rest))
+    return hashed, rejected
+
+
+async def hash_batch(pool, workers: int, batch):
+    last, rows, rejected = batch
+    loop = asyncio.get_running_loop()
+    size = -(-len(rows) // workers) or 1
+    slices = [rows[i : i + size] for i in range(0, len(rows), size)]
+    results = await asyncio.gather(*(loop.run_in_executor(pool, hash_rows, s) for s in slices))
+    hashed = [row for rows, _ in results for row in rows]
+    return last, hashed, rejected + [error for _, errors in results for error in errors]
+
+
+async def load_batch(conn, rows):
+    """Copy one batch into the staging table and merge it in a single transaction.
+
+    Every merge skips what already exists, so a batch that is loaded twice after
+    a crash adds nothing the second time.
+    """
+    async with conn.begin():
+        await conn.execute(select(func.pg_advisory_xact_lock(func.hashtext("import_users"))))
+        await conn.execute(text(STAGING))
+        raw = await conn.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(
+            "import_row", records=rows, columns=["line", *FIELDS]
+        )
+        await conn.execute(text("ANALYZE import_row"))
+
+        await conn.execute(text(MERGE_ORGANISATIONS))
+        await conn.execute(text(RESOLVE_ORGANISATIONS))
+        await conn.execute(text(MERGE_ROLES))
+        await conn.execute(text(RESOLVE_ROLES))
+        users = (await conn.execute(text(MERGE_USERS))).rowcount
+        await conn.execute(text(RESOLVE_USERS))
+
+        added = defaultdict(list)
+        for org_id, role_id, user_id in await conn.execute(text(MERGE_MEMBERS)):
+            added[org_id, role_id].append(user_id)
+        for (org_id, role_id), user_ids in added.items():
+            await record_memberships(conn, org_id, role_id, user_ids)
+        if added:
+            await bump_version(conn, *(org_id for org_id, _ in added))
+    return users, sum(len(user_ids) for user_ids in added.values())
+
+
+def read_checkpoint(path: str, source: str) -> int:
+    try:
+        with open(path) as f:
+            checkpoint = json.load(f)
+    except FileNotFoundError:
+        return 0
+    if checkpoint.get("source") != source:
+        raise SystemExit(f"{path} belongs to {checkpoint.get('source')}, not {source}")
+    return checkpoint["records"]
+
+
+def write_checkpoint(path: str, source: str, records: int):
+    with open(f"{path}.tmp", "w") as f:
+        json.dump({"source": source, "records": records}, f)
+    os.replace(f"{path}.tmp", path)
+
+
+async def import_users(
+    path: str, fmt: str, batch_size: int, workers: int, checkpoint: str, progress=sys.stderr
+):
+    """Import users, organisations, roles and memberships from `path`.
+
+    Records are read and validated in batches; the process pool hashes the next batch
+    while the current one is loaded. The number of records committed so far is kept in
+    `checkpoint`, and a rerun continues after it.
+    """
+    source = os.path.abspath(path)
+    skip = read_checkpoint(checkpoint, source)
+    if skip:
+        print(f"Resuming after record {skip}", file=progress)
+    db = get_session_manager(settings.DB_URL, **settings.db_options)
+    totals = {"records": 0, "rejected": 0, "users": 0, "members": 0}
+    started = time.monotonic()
+
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(argon2_params(),)) as pool:
+        async with db.engine.connect() as conn:
+            await create_member_partitions(0, conn)
+            batches = read_batches(path, fmt, batch_size, skip)
+
+            def hash_next():
+                batch = next(batches, None)
+                if batch is None:
+                    return None
+                return asyncio.ensure_future(hash_batch(pool, workers, batch))
+
+            hashing = hash_next()
+            while hashing:
+                last, rows, rejected = await hashing
+                hashing = hash_next()
+                users, members = await load_batch(conn, rows) if rows else (0, 0)
+                write_checkpoint(checkpoint, source, last)
+
+                for error in rejected:
+                    print(f"Rejected {error}", file=progress)
+                totals["records"] = last - skip
+                totals["rejected"] += len(rejected)
+                totals["users"] += users
+                totals["members"] += members
+                rate = totals["records"] / (time.monotonic() - started)
+                print(
+                    f"{last} records ({rate:.0f}/s): {totals['users']} users, "
+                    f"{totals['members']} memberships added, {totals['rejected']} rejected",
+                    file=progress,
+                )
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    return totals
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Bulk import users into organisations")
+    parser.add_argument("path", help="CSV with a header row, or NDJSON, of email,password,org,role")
+    parser.add_argument("--format", choices=["csv", "ndjson"], default=None)
+    parser.add_argument("--batch-size", type=int, default=settings.IMPORT_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=settings.IMPORT_HASH_WORKERS)
+    parser.add_argument("--checkpoint", default=None, help="defaults to <path>.checkpoint")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    args = parser.parse_args()
+
+    fmt = args.format or ("ndjson" if args.path.endswith((".ndjson", ".jsonl")) else "csv")
+    checkpoint = args.checkpoint or f"{args.path}.checkpoint"
+    if args.restart and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    workers = args.workers or os.cpu_count() or 1
+
+    totals = await import_users(args.path, fmt, args.batch_size, workers, checkpoint)
+    print(
+        f"Imported {totals['records']} records: {totals['users']} users and "
+        f"{totals['members']} memberships added, {totals['rejected']} rejected"
+    )
+    await get_session_manager(settings.DB_URL, **settings.db_options).close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,124 @@
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from sqlalchemy import column, func, insert, literal, select, update, values
+from sqlalchemy.dialects.postgresql import JSONB, insert as pg_insert
+from sqlalchemy.types import BigInteger, DateTime, Integer
+
+from .models import Member, MemberKey, Role
+from .sketches import record_membership, record_memberships
+from .versions import bump_version
+
+
+async def add_member(session, org_id: int, user_id: int, role_id: int):
+    """Insert a membership unless (org_id, user_id) already has one.
+
+    Returns the new member id, or None when the user was already a member.
+    """
+    now = datetime.now(tz=timezone.utc)
+    claimed = (
+        pg_insert(MemberKey)
+        .values(org_id=org_id, user_id=user_id)
+        .on_conflict_do_nothing()
+        .returning(MemberKey.org_id, MemberKey.user_id)
+        .cte("claimed")
+    )
+    query = (
+        insert(Member)
+        .from_select(
+            ["org_id", "user_id", "role_id", "status", "settings", "created_at", "updated_at"],
+            select(
+                claimed.c.org_id,
+                claimed.c.user_id,
+                literal(role_id, BigInteger),
+                literal(0, Integer),
+                literal({}, JSONB),
+                literal(now, DateTime(timezone=True)),
+                literal(now, DateTime(timezone=True)),
+            ),
+        )
+        .returning(Member.id)
+    )
+    result = await session.execute(query)
+    member_id = result.scalar_one_or_none()
+    if member_id:
+        await record_membership(session, org_id, role_id, user_id, day=now.date())
+        await bump_version(session, org_id)
+    return member_id
+
+
+async def reassign_roles(session, org_id: int, changes):
+    """Move members of one organisation to new roles in a single UPDATE ... FROM (VALUES ...).
+
+    `changes` is a list of (user_id, role_id) pairs. Returns the pairs that changed,
+    the ones that already had that role, and the ones that failed with a reason.
+    """
+    changed, unchanged, failed = [], [], []
+
+    pending = {}
+    for user_id, role_id in changes:
+        if user_id in pending:
+            failed.append({"user_id": user_id, "role_id": role_id, "reason": "Duplicate user"})
+        else:
+            pending[user_id] = role_id
+
+    role_ids = set(pending.values())
+    result = await session.execute(
+        select(Role.id).where(Role.org_id == org_id, Role.id.in_(role_ids))
+    )
+    valid_roles = set(result.scalars().all())
+    for user_id, role_id in list(pending.items()):
+        if role_id not in valid_roles:
+            failed.append({"user_id": user_id, "role_id": role_id, "reason": "Role not found"})
+            del pending[user_id]
+    if not pending:
+        return changed, unchanged, failed
+
+    requested = values(
+        column("user_id", BigInteger), column("role_id", BigInteger), name="pairs"
+    ).data(list(pending.items()))
+    requested = select(requested).cte("requested")
+    # CTEs see the table as it was before the UPDATE, so previous holds the old roles.
+    previous = (
+        select(Member.user_id, Member.role_id)
+        .where(Member.org_id == org_id, Member.user_id.in_(select(requested.c.user_id)))
+        .cte("previous")
+    )
+    updated = (
+        update(Member)
+        .where(
+            Member.org_id == org_id,
+            Member.user_id == requested.c.user_id,
+            Member.role_id != requested.c.role_id,
+        )
+        .values(role_id=requested.c.role_id, updated_at=func.now())
+        .returning(Member.user_id)
+        .cte("updated")
+    )
+    query = (
+        select(
+            requested.c.user_id,
+            requested.c.role_id,
+            previous.c.role_id.label("previous_role_id"),
+            updated.c.user_id.label("updated_user_id"),
+        )
+        .outerjoin(previous, previous.c.user_id == requested.c.user_id)
+        .outerjoin(updated, updated.c.user_id == requested.c.user_id)
+    )
+
+    moved = defaultdict(list)
+    for row in await session.execute(query):
+        item = {"user_id": row.user_id, "role_id": row.role_id}
+        if row.updated_user_id is not None:
+            changed.append(item)
+            moved[row.role_id].append(row.user_id)
+        elif row.previous_role_id is None:
+            failed.append({**item, "reason": "Member not found"})
+        else:
+            unchanged.append(item)
+
+    for role_id, user_ids in moved.items():
+        await record_memberships(session, org_id, role_id, user_ids)
+    if changed:
+        await bump_version(session, org_id)
+    return changed, unchanged, failed
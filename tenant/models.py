@@ -1,26 +1,39 @@
 import datetime
-from datetime import datetime, timezone
+from datetime import date, datetime, timezone
+from enum import IntEnum
 from typing import Any, List
 
-from passlib.context import CryptContext
-from sqlalchemy import JSON, BigInteger, Boolean, DateTime, ForeignKey, Integer, String
+from sqlalchemy import (
+    BigInteger,
+    Boolean,
+    Date,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    LargeBinary,
+    String,
+)
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.asyncio import AsyncAttrs
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
-from core.db_manager import DatabaseManager
+from core.db_manager import Repository, get_session_manager
 from core.settings import settings
+from core.tracing import span
+
+from .passwords import get_pwd_context
 
 
 async def get_db_session():
-    try:
-        db_manager = DatabaseManager(settings.DB_URL)
-        yield db_manager
-    finally:
-        await db_manager.session.close()
-        await db_manager.db.close()
+    db = get_session_manager(settings.DB_URL, **settings.db_options)
+    async with db.session_maker() as session:
+        yield session
 
 
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
+class Status(IntEnum):
+    ACTIVE = 0
+    PURGING = 1
 
 
 class Base(AsyncAttrs, DeclarativeBase):
@@ -39,7 +52,7 @@ class BaseModel(Base):
 
     id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True, index=True)
     status: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
-    settings: Mapped[JSON] = mapped_column(JSON, nullable=False, default={})
+    settings: Mapped[JSONB] = mapped_column(JSONB, nullable=False, default={})
     created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), default=lambda: datetime.now(tz=timezone.utc)
     )
@@ -52,28 +65,44 @@ class BaseModel(Base):
 
 class Organisation(BaseModel):
     __tablename__ = "organisation"
+    __table_args__ = (
+        Index(
+            "ix_organisation_settings",
+            "settings",
+            postgresql_using="gin",
+            postgresql_ops={"settings": "jsonb_path_ops"},
+        ),
+    )
 
     name: Mapped[str] = mapped_column(String(length=50), index=True, nullable=False)
     personal: Mapped[bool] = mapped_column(Boolean, default=False, nullable=True)
 
     roles: Mapped[List["Role"]] = relationship(
-        "Role", back_populates="organisation", cascade="all, delete"
+        "Role", back_populates="organisation", cascade="all, delete", passive_deletes=True
     )
 
     members: Mapped[List["Member"]] = relationship(
-        "Member", back_populates="organisation", cascade="all, delete"
+        "Member", back_populates="organisation", cascade="all, delete", passive_deletes=True
     )
 
 
 class User(BaseModel):
     __tablename__ = "user"
+    __table_args__ = (
+        Index(
+            "ix_user_profile",
+            "profile",
+            postgresql_using="gin",
+            postgresql_ops={"profile": "jsonb_path_ops"},
+        ),
+    )
 
     email: Mapped[str] = mapped_column(String(length=100), unique=True, nullable=False)
     password: Mapped[str] = mapped_column(String(255), nullable=False)
-    profile: Mapped[JSON] = mapped_column(JSON, nullable=False, default={})
+    profile: Mapped[JSONB] = mapped_column(JSONB, nullable=False, default={})
 
     members: Mapped[List["Member"]] = relationship(
-        "Member", back_populates="user", cascade="all, delete"
+        "Member", back_populates="user", cascade="all, delete", passive_deletes=True
     )
 
     def __init__(self, **kw: Any):
@@ -81,10 +110,16 @@ class User(BaseModel):
         super().__init__(**kw)
 
     def set_password(self, raw_password):
-        return pwd_context.hash(raw_password)
+        with span("password.hash"):
+            return get_pwd_context().hash(raw_password)
 
     def verify_password(self, raw_password):
-        return pwd_context.verify(raw_password, self.password)
+        # Hashes made with outdated argon2 parameters are replaced on a successful verify.
+        with span("password.verify"):
+            valid, new_hash = get_pwd_context().verify_and_update(raw_password, self.password)
+        if valid and new_hash:
+            self.password = new_hash
+        return valid
 
 
 class Role(Base):
@@ -101,12 +136,23 @@ class Role(Base):
     )
 
     members: Mapped[List["Member"]] = relationship(
-        "Member", back_populates="roles", cascade="all, delete"
+        "Member", back_populates="roles", cascade="all, delete", passive_deletes=True
     )
 
 
 class Member(BaseModel):
     __tablename__ = "member"
+    __table_args__ = (
+        Index("ix_member_org_id_created_at", "org_id", "created_at"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
+    # Partitioned monthly by created_at, so the partition key is part of the primary key.
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        primary_key=True,
+        default=lambda: datetime.now(tz=timezone.utc),
+    )
 
     org_id: Mapped[BigInteger] = mapped_column(
         ForeignKey("organisation.id", ondelete="CASCADE"), nullable=False
@@ -128,3 +174,65 @@ class Member(BaseModel):
     roles: Mapped[Role] = relationship(
         "Role", back_populates="members", single_parent=True, uselist=False
     )
+
+
+class MemberKey(Base):
+    # Enforces one membership per (org, user); member itself is partitioned by created_at
+    # and Postgres only allows unique constraints there that include the partition key.
+    __tablename__ = "member_key"
+
+    org_id: Mapped[BigInteger] = mapped_column(
+        ForeignKey("organisation.id", ondelete="CASCADE"), primary_key=True
+    )
+    user_id: Mapped[BigInteger] = mapped_column(
+        ForeignKey("user.id", ondelete="CASCADE"), primary_key=True
+    )
+
+
+class ConsumedToken(Base):
+    __tablename__ = "consumed_token"
+
+    jti: Mapped[str] = mapped_column(String(length=32), primary_key=True)
+    expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), index=True)
+
+
+class MemberSketch(Base):
+    # HyperLogLog registers of the users holding a role in an organisation on a given day.
+    __tablename__ = "member_sketch"
+
+    org_id: Mapped[BigInteger] = mapped_column(
+        ForeignKey("organisation.id", ondelete="CASCADE"), primary_key=True
+    )
+    role_id: Mapped[BigInteger] = mapped_column(
+        ForeignKey("role.id", ondelete="CASCADE"), primary_key=True
+    )
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    registers: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+
+
+class MemberSketchMonth(Base):
+    # Monthly rollup of member_sketch, so long windows merge one row per month.
+    __tablename__ = "member_sketch_month"
+
+    org_id: Mapped[BigInteger] = mapped_column(
+        ForeignKey("organisation.id", ondelete="CASCADE"), primary_key=True
+    )
+    role_id: Mapped[BigInteger] = mapped_column(
+        ForeignKey("role.id", ondelete="CASCADE"), primary_key=True
+    )
+    month: Mapped[date] = mapped_column(Date, primary_key=True)
+    registers: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+
+
+class DataVersion(Base):
+    # Bumped on every membership write; the sum over all rows identifies the current data.
+    __tablename__ = "data_version"
+
+    org_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    version: Mapped[int] = mapped_column(BigInteger, nullable=False)
+
+
+users = Repository(User)
+organisations = Repository(Organisation)
+roles = Repository(Role)
+members = Repository(Member)
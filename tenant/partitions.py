@@ -0,0 +1,109 @@
+import argparse
+import asyncio
+import logging
+import re
+from datetime import datetime
+
+from sqlalchemy import text
+
+from core.db_manager import get_session_manager, resolve_session, session_scope
+from core.settings import settings
+
+from .versions import bump_version
+
+logger = logging.getLogger(__name__)
+
+PARTITION_NAME = re.compile(r"^member_p(\d{4})_(\d{2})$")
+
+
+async def create_member_partitions(months_ahead: int, session=None):
+    session = resolve_session(session)
+    result = await session.execute(
+        text("SELECT create_member_partitions(now(), now() + make_interval(months => :months))"),
+        {"months": months_ahead},
+    )
+    await session.commit()
+    return result.scalar()
+
+
+async def maintain_member_partitions(db, months_ahead: int, interval: float):
+    """Create upcoming partitions now and again every `interval` seconds until cancelled.
+
+    Failures are logged and retried on the next run; rows that arrive before their
+    month's partition exists wait in member_default and are moved when it is created.
+    """
+    while True:
+        try:
+            async with session_scope(db):
+                created = await create_member_partitions(months_ahead)
+            if created:
+                logger.info("Created %d member partition(s)", created)
+        except Exception:
+            logger.exception("Creating member partitions failed")
+        await asyncio.sleep(interval)
+
+
+async def member_partitions(session=None):
+    session = resolve_session(session)
+    result = await session.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = CAST('member' AS regclass)"
+        )
+    )
+    partitions = {}
+    for (name,) in result.fetchall():
+        match = PARTITION_NAME.match(name)
+        if match:
+            partitions[name] = datetime(int(match[1]), int(match[2]), 1)
+    return partitions
+
+
+async def archive_member_partitions(before: datetime, schema: str = "archive", session=None):
+    """Detach monthly partitions older than `before` and move them to `schema`."""
+    session = resolve_session(session)
+    cutoff = datetime(before.year, before.month, 1)
+    archived = []
+    await session.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{schema}"'))
+    for name, month in sorted((await member_partitions(session)).items()):
+        if month >= cutoff:
+            continue
+        # Detaching does not fire member_release_key, so release the memberships' keys here.
+        released = await session.execute(
+            text(
+                f'DELETE FROM member_key k USING "{name}" m '
+                "WHERE k.org_id = m.org_id AND k.user_id = m.user_id RETURNING k.org_id"
+            )
+        )
+        await session.execute(text(f'ALTER TABLE member DETACH PARTITION "{name}"'))
+        # The archived memberships drop out of the stats, so cached responses are stale.
+        await bump_version(session, *set(released.scalars().all()))
+        await session.execute(text(f'ALTER TABLE "{name}" SET SCHEMA "{schema}"'))
+        archived.append(f"{schema}.{name}")
+    await session.commit()
+    return archived
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Manage monthly partitions of the member table")
+    commands = parser.add_subparsers(dest="command", required=True)
+    create = commands.add_parser("create", help="create partitions for upcoming months")
+    create.add_argument("--months-ahead", type=int, default=settings.MEMBER_PARTITIONS_AHEAD)
+    archive = commands.add_parser("archive", help="detach and archive old partitions")
+    archive.add_argument("--before", type=datetime.fromisoformat, required=True)
+    archive.add_argument("--schema", default="archive")
+    args = parser.parse_args()
+
+    db = get_session_manager(settings.DB_URL, **settings.db_options)
+    async with session_scope(db):
+        if args.command == "create":
+            created = await create_member_partitions(args.months_ahead)
+            print(f"Created {created} partition(s)")
+        else:
+            for name in await archive_member_partitions(args.before, args.schema):
+                print(f"Archived {name}")
+    await db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
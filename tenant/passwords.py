@@ -0,0 +1,127 @@
+import argparse
+import asyncio
+import os
+import time
+from functools import lru_cache
+
+from sqlalchemy import func, select
+
+from core.db_manager import get_session_manager, resolve_session, session_scope
+from core.settings import settings
+
+MIN_MEMORY_COST = 19456  # KiB, the OWASP minimum for argon2id
+
+_overrides = {}
+
+
+def argon2_params():
+    params = {
+        "rounds": settings.ARGON2_TIME_COST,
+        "memory_cost": settings.ARGON2_MEMORY_COST,
+        "parallelism": settings.ARGON2_PARALLELISM,
+    }
+    params.update(_overrides)
+    return {k: v for k, v in params.items() if v}
+
+
+@lru_cache
+def get_pwd_context():
+    # passlib and the argon2 backend are only loaded when the first password is hashed.
+    from passlib.context import CryptContext
+
+    context_params = {f"argon2__{k}": v for k, v in argon2_params().items()}
+    return CryptContext(schemes=["argon2"], deprecated="auto", **context_params)
+
+
+def use_argon2_params(**params):
+    _overrides.update(params)
+    get_pwd_context.cache_clear()
+
+
+def hash_time_ms(rounds: int, memory_cost: int, parallelism: int, samples: int = 3) -> float:
+    from passlib.hash import argon2
+
+    hasher = argon2.using(rounds=rounds, memory_cost=memory_cost, parallelism=parallelism)
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        hasher.hash("calibration-password")
+        timings.append((time.perf_counter() - start) * 1000)
+    return min(timings)
+
+
+def calibrate_argon2(target_ms: float, memory_cost: int = 65536, parallelism: int = None):
+    """Pick argon2 parameters whose hash time on this machine is closest to `target_ms`.
+
+    Memory is halved (down to the OWASP minimum) while one pass is already too slow,
+    then passes are added until the next one would overshoot the target.
+    """
+    parallelism = parallelism or min(os.cpu_count() or 1, 4)
+    rounds = 1
+    elapsed = hash_time_ms(rounds, memory_cost, parallelism)
+    while elapsed > target_ms and memory_cost // 2 >= MIN_MEMORY_COST:
+        memory_cost //= 2
+        elapsed = hash_time_ms(rounds, memory_cost, parallelism)
+    while True:
+        slower = hash_time_ms(rounds + 1, memory_cost, parallelism)
+        if slower > target_ms:
+            break
+        rounds, elapsed = rounds + 1, slower
+    return {
+        "rounds": rounds,
+        "memory_cost": memory_cost,
+        "parallelism": parallelism,
+        "elapsed_ms": round(elapsed, 1),
+    }
+
+
+async def hash_cost_report(session=None):
+    """Count stored password hashes per argon2 parameter set."""
+    from .models import User
+
+    session = resolve_session(session)
+    params = func.substring(User.password, r"^\$(argon2[a-z]*\$v=\d+\$m=\d+,t=\d+,p=\d+)")
+    result = await session.execute(
+        select(params.label("params"), func.count().label("count"))
+        .group_by(params)
+        .order_by(func.count().desc())
+    )
+    current = get_pwd_context().hash("report")
+    current = current[1 : current.rindex("$", 0, current.rindex("$"))]
+    return [
+        {"params": row.params or "unknown", "count": row.count, "current": row.params == current}
+        for row in result
+    ]
+
+
+async def report():
+    db = get_session_manager(settings.DB_URL, **settings.db_options)
+    async with session_scope(db):
+        for row in await hash_cost_report():
+            marker = "" if row["current"] else "  (rehashed on next login)"
+            print(f"{row['count']:>10}  {row['params']}{marker}")
+    await db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Argon2 cost calibration and reporting")
+    commands = parser.add_subparsers(dest="command", required=True)
+    calibrate = commands.add_parser("calibrate", help="benchmark argon2 on this machine")
+    calibrate.add_argument("--target-ms", type=float, default=250)
+    calibrate.add_argument("--memory-cost", type=int, default=65536)
+    calibrate.add_argument("--parallelism", type=int, default=None)
+    commands.add_parser("report", help="show the hash cost distribution of stored users")
+    args = parser.parse_args()
+
+    if args.command == "calibrate":
+        params = calibrate_argon2(args.target_ms, args.memory_cost, args.parallelism)
+        print(f"# {params['elapsed_ms']} ms per hash")
+        print(f"ARGON2_TIME_COST={params['rounds']}")
+        print(f"ARGON2_MEMORY_COST={params['memory_cost']}")
+        print(f"ARGON2_PARALLELISM={params['parallelism']}")
+    else:
+        asyncio.run(report())
+
+
+if __name__ == "__main__":
+    main()
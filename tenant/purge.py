@@ -0,0 +1,115 @@
+import argparse
+import asyncio
+import contextvars
+import logging
+
+from sqlalchemy import delete, func, select, tuple_
+
+from core.db_manager import get_session_manager, resolve_session
+from core.settings import settings
+
+from .models import Member, MemberKey, MemberSketch, MemberSketchMonth, Organisation, Role, Status
+from .versions import bump_version
+
+logger = logging.getLogger(__name__)
+
+_running = set()
+
+
+async def delete_in_chunks(
+    conn, org_id: int, model, key_columns, where, chunk_size: int, pause: float
+):
+    """Delete matching rows `chunk_size` at a time, committing and pausing between chunks."""
+    deleted = 0
+    while True:
+        chunk = select(*key_columns).where(where).limit(chunk_size)
+        async with conn.begin():
+            result = await conn.execute(delete(model).where(tuple_(*key_columns).in_(chunk)))
+            await bump_version(conn, org_id)
+        deleted += result.rowcount
+        if result.rowcount < chunk_size:
+            return deleted
+        await asyncio.sleep(pause)
+
+
+async def purge_organisation(org_id: int, chunk_size: int = None, pause: float = None):
+    """Delete an organisation and everything under it without long locks or big transactions.
+
+    Safe to re-run: every step only removes what is left, and an advisory lock
+    keeps two workers from purging the same organisation at once.
+    """
+    chunk_size = chunk_size or settings.PURGE_CHUNK_SIZE
+    pause = settings.PURGE_PAUSE_MS / 1000 if pause is None else pause
+    db = get_session_manager(settings.DB_URL, **settings.db_options)
+
+    async with db.engine.connect() as conn:
+        lock = func.pg_try_advisory_lock(func.hashtext("purge_organisation"), org_id)
+        if not (await conn.execute(select(lock))).scalar():
+            return False
+        await conn.commit()
+        try:
+            steps = [
+                (Member, (Member.id, Member.created_at), Member.org_id == org_id),
+                (MemberKey, (MemberKey.org_id, MemberKey.user_id), MemberKey.org_id == org_id),
+                (
+                    MemberSketch,
+                    (MemberSketch.org_id, MemberSketch.role_id, MemberSketch.day),
+                    MemberSketch.org_id == org_id,
+                ),
+                (
+                    MemberSketchMonth,
+                    (MemberSketchMonth.org_id, MemberSketchMonth.role_id, MemberSketchMonth.month),
+                    MemberSketchMonth.org_id == org_id,
+                ),
+                (Role, (Role.id,), Role.org_id == org_id),
+            ]
+            for model, key_columns, where in steps:
+                deleted = await delete_in_chunks(
+                    conn, org_id, model, key_columns, where, chunk_size, pause
+                )
+                logger.info(
+                    "Purged %d %s row(s) of organisation %s", deleted, model.__tablename__, org_id
+                )
+            async with conn.begin():
+                await conn.execute(delete(Organisation).where(Organisation.id == org_id))
+        finally:
+            await conn.execute(
+                select(func.pg_advisory_unlock(func.hashtext("purge_organisation"), org_id))
+            )
+            await conn.commit()
+    return True
+
+
+def schedule_purge(org_id: int):
+    # A fresh context keeps the purge out of the caller's trace and session scope, both of
+    # which end long before it does. Keep a reference so the task is not garbage collected.
+    task = asyncio.create_task(purge_organisation(org_id), context=contextvars.Context())
+    _running.add(task)
+    task.add_done_callback(_running.discard)
+    return task
+
+
+async def resume_purges(session=None):
+    """Restart purges that were interrupted, e.g. by a deploy."""
+    session = resolve_session(session)
+    result = await session.execute(
+        select(Organisation.id).where(Organisation.status == Status.PURGING)
+    )
+    for org_id in result.scalars().all():
+        schedule_purge(org_id)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Purge an organisation in bounded chunks")
+    parser.add_argument("org_id", type=int)
+    parser.add_argument("--chunk-size", type=int, default=settings.PURGE_CHUNK_SIZE)
+    parser.add_argument("--pause-ms", type=int, default=settings.PURGE_PAUSE_MS)
+    args = parser.parse_args()
+
+    purged = await purge_organisation(args.org_id, args.chunk_size, args.pause_ms / 1000)
+    print("Purged" if purged else "Organisation is already being purged")
+    await get_session_manager(settings.DB_URL, **settings.db_options).close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
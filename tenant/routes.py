@@ -3,12 +3,24 @@ from typing import Annotated
 from fastapi import APIRouter, Body, Depends, HTTPException, Request, Response, status
 from fastapi.responses import JSONResponse
 from sqlalchemy.exc import SQLAlchemyError
-
-from core.db_manager import DatabaseManager
-
-from .models import Member, Organisation, Role, User, get_db_session
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .members import add_member, reassign_roles
+from .models import (
+    Member,
+    Status,
+    User,
+    get_db_session,
+    members,
+    organisations,
+    roles,
+    users,
+)
+from .purge import schedule_purge
 from .schemas import *
-from .tokens import Audience, JWTUtils
+from .sketches import record_membership
+from .tokens import Audience, JWTUtils, consumed_tokens
+from .versions import bump_version
 from .utils import send_mail
 
 user = APIRouter(prefix="/api/user", tags=["User"])
@@ -21,28 +33,30 @@ user = APIRouter(prefix="/api/user", tags=["User"])
     responses={400: {"model": BaseErrorResponseSchema}},
 )
 async def register_user(
-    body: RegisterUserSchema, request: Request, db: DatabaseManager = Depends(get_db_session)
+    body: RegisterUserSchema, request: Request, session: AsyncSession = Depends(get_db_session)
 ):
-    async with db.session.begin():
+    async with session.begin():
         try:
             payload = body.model_dump()
             email = payload.get("email")
             password = payload.get("password")
-            is_user_exist = await db.model(User).get_or_none(email=email)
+            is_user_exist = await users.get_or_none(session, email=email)
             if is_user_exist:
                 raise SQLAlchemyError("User already exists")
-            user: User = await db.model(User).create_instance(email=email, password=password)
+            user: User = await users.create_instance(session, email=email, password=password)
 
             org_name = payload.get("org_name")
-            organisation = await db.model(Organisation).get_or_create_instance(name=org_name)
+            organisation = await organisations.get_or_create_instance(
+                session, name=org_name, status=Status.ACTIVE
+            )
 
             role = payload.get("role")
             description = payload.get("description")
 
-            role = await db.model(Role).get_or_create_instance(name=role, org_id=organisation.id)
+            role = await roles.get_or_create_instance(session, name=role, org_id=organisation.id)
             if description:
                 role.description = description
-                # await db.save()
+                # await session.commit()
 
             invitation_payload = {
                 "user_id": user.id,
@@ -58,13 +72,13 @@ async def register_user(
                 to_email=user.email, subject="MultiTenant Member Invitation", content=str(url)
             )
             if status_code >= 400:
-                await db.session.rollback()
+                await session.rollback()
                 raise HTTPException(
                     detail="Error occured when trying to send mail",
                     status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 )
 
-            await db.save()
+            await session.commit()
 
             user_data = user.to_dict
             user_data.update(organisation=organisation.to_dict, role=role.to_dict)
@@ -86,10 +100,10 @@ async def register_user(
     response_model=BaseResponseSchema,
 )
 async def login_user(
-    body: LoginUserSchema, response: Response, db: DatabaseManager = Depends(get_db_session)
+    body: LoginUserSchema, response: Response, session: AsyncSession = Depends(get_db_session)
 ):
     payload = body.model_dump()
-    user = await db.model(User).authenticate(**payload)
+    user = await users.authenticate(session, **payload)
     if not user:
         return JSONResponse(
             content={
@@ -110,7 +124,7 @@ async def login_user(
         content="""We noticed a new sign-in to your MultiTenant Account""",
     )
     if status_code >= 400:
-        await db.session.rollback()
+        await session.rollback()
         raise HTTPException(
             detail="Error occured when trying to send mail",
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -124,9 +138,9 @@ async def login_user(
 
 @user.post("/forgotPassword")
 async def forgot_password(
-    body: ForgotPassSchema, request: Request, db: DatabaseManager = Depends(get_db_session)
+    body: ForgotPassSchema, request: Request, session: AsyncSession = Depends(get_db_session)
 ):
-    user = await db.model(User).get_or_none(email=body.email)
+    user = await users.get_or_none(session, email=body.email)
     if not user:
         return JSONResponse(
             content={
@@ -143,7 +157,7 @@ async def forgot_password(
         to_email=user.email, subject="MultiTenant Reset Password", content=str(url)
     )
     if status_code >= 400:
-        await db.session.rollback()
+        await session.rollback()
         raise HTTPException(
             detail="Error occured when trying to send mail",
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -161,7 +175,7 @@ async def reset_password(
     body: ResetPassSchema,
     request: Request,
     token: str,
-    db: DatabaseManager = Depends(get_db_session),
+    session: AsyncSession = Depends(get_db_session),
 ):
     if not token:
         return JSONResponse(
@@ -174,15 +188,18 @@ async def reset_password(
     token_payload = await JWTUtils.decode_token(
         token=token, aud=Audience.RE_PASS.value, request=request
     )
-    user_id = token_payload.get("user_id")
+    user_id = token_payload.get("user_id") if token_payload else None
     if not user_id:
         raise KeyError("Invalid token")
-    user = await db.model(User).get_or_none(id=user_id)
+    if not await consumed_tokens.consume(session, token_payload):
+        raise HTTPException(detail="Token already used", status_code=status.HTTP_403_FORBIDDEN)
+    user = await users.get_or_none(session, id=user_id)
     if not user:
         raise HTTPException(detail="User does not exist", status_code=status.HTTP_400_BAD_REQUEST)
 
     user.password = user.set_password(body.new_password)
-    await db.save()
+    await session.commit()
+    consumed_tokens.remember(token_payload["jti"])
 
     status_code = await send_mail(
         to_email=user.email,
@@ -190,7 +207,7 @@ async def reset_password(
         content="""Recently password associated with this mail id has been changed.""",
     )
     if status_code >= 400:
-        await db.session.rollback()
+        await session.rollback()
         raise HTTPException(
             detail="Error occured when trying to send mail",
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -201,20 +218,29 @@ async def reset_password(
 
 @user.get("/inviteMember/{token}")
 async def invite_member(
-    token: str, request: Request, db: DatabaseManager = Depends(get_db_session)
+    token: str, request: Request, session: AsyncSession = Depends(get_db_session)
 ):
     if not token:
         raise HTTPException(detail="Token not found", status_code=status.HTTP_404_NOT_FOUND)
 
     payload = await JWTUtils.decode_token(token=token, aud=Audience.INVITE.value, request=request)
-    if "user_id" not in payload or "org_id" not in payload or "role_id" not in payload:
+    if (
+        not payload
+        or "user_id" not in payload
+        or "org_id" not in payload
+        or "role_id" not in payload
+    ):
         raise HTTPException(detail="Improper data provided", status_code=status.HTTP_403_FORBIDDEN)
 
     user_id = payload["user_id"]
     org_id = payload["org_id"]
     role_id = payload["role_id"]
 
-    await db.model(Member).create(user_id=user_id, org_id=org_id, role_id=role_id)
+    if not await consumed_tokens.consume(session, payload):
+        raise HTTPException(detail="Token already used", status_code=status.HTTP_403_FORBIDDEN)
+    await add_member(session, org_id=org_id, user_id=user_id, role_id=role_id)
+    await session.commit()
+    consumed_tokens.remember(payload["jti"])
 
     return {
         "message": "Successfully added as member to organisation",
@@ -225,14 +251,14 @@ async def invite_member(
 
 @user.delete("/{user_id}/deleteMember/{member_id}")
 async def delete_member(
-    user_id: int, member_id: int, db: DatabaseManager = Depends(get_db_session)
+    user_id: int, member_id: int, session: AsyncSession = Depends(get_db_session)
 ):
     if not user_id or member_id:
         raise HTTPException(
             detail="Improper data provided", status_code=status.HTTP_400_BAD_REQUEST
         )
 
-    member: Member = await db.model(Member).get_or_none(id=member_id)
+    member: Member = await members.get_or_none(session, id=member_id)
     if not member:
         raise HTTPException(
             detail="Invalid member details", status_code=status.HTTP_400_BAD_REQUEST
@@ -241,7 +267,8 @@ async def delete_member(
     if member.user_id != user_id:
         raise HTTPException(detail="You are not a member", status_code=status.HTTP_400_BAD_REQUEST)
 
-    await db.model(Member).delete(id=member_id)
+    await bump_version(session, member.org_id)
+    await members.delete(session, id=member_id)
 
     return {
         "message": "Successfully Membership Removed",
@@ -252,19 +279,19 @@ async def delete_member(
 
 @user.patch("/updateRole")
 async def update_member_role(
-    body: UpdateMemberSchema, db: DatabaseManager = Depends(get_db_session)
+    body: UpdateMemberSchema, session: AsyncSession = Depends(get_db_session)
 ):
     payload = body.model_dump()
     org_id = payload.get("org_id")
     user_id = payload.get("user_id")
     role_id = payload.get("role_id")
 
-    role = await db.model(Role).get_or_none(id=role_id)
+    role = await roles.get_or_none(session, id=role_id)
 
     if not role:
         raise HTTPException(detail="Role not found", status_code=status.HTTP_404_NOT_FOUND)
 
-    member = await db.model(Member).get_or_none(org_id=org_id, user_id=user_id)
+    member = await members.get_or_none(session, org_id=org_id, user_id=user_id)
 
     if not member:
         raise HTTPException(detail="Member not found", status_code=status.HTTP_404_NOT_FOUND)
@@ -277,11 +304,74 @@ async def update_member_role(
         }
 
     member.role_id = role.id
+    await record_membership(session, org_id, role.id, user_id)
+    await bump_version(session, org_id)
 
-    await db.save()
+    await session.commit()
 
     return {
         "message": "Successfully Role has been Updated",
         "status": "success",
         "data": {},
     }
+
+
+@user.patch("/updateRoles")
+async def update_member_roles(
+    body: BatchUpdateMemberSchema, session: AsyncSession = Depends(get_db_session)
+):
+    changes = [(member.user_id, member.role_id) for member in body.members]
+    changed, unchanged, failed = await reassign_roles(session, body.org_id, changes)
+    await session.commit()
+
+    return {
+        "message": f"{len(changed)} member role(s) updated",
+        "status": "success",
+        "data": {"changed": changed, "unchanged": unchanged, "failed": failed},
+    }
+
+
+def json_changes(body: JsonPatchSchema):
+    changes = {tuple(path.split(".")): value for path, value in body.update.items()}
+    return changes, [tuple(path.split(".")) for path in body.remove]
+
+
+@user.patch("/{user_id}/profile")
+async def update_profile(
+    user_id: int, body: JsonPatchSchema, session: AsyncSession = Depends(get_db_session)
+):
+    changes, remove = json_changes(body)
+    profile = await users.patch_json(session, "profile", changes, remove, id=user_id)
+    if profile is None:
+        raise HTTPException(detail="User does not exist", status_code=status.HTTP_404_NOT_FOUND)
+
+    return {"message": "Profile updated", "status": "success", "data": profile}
+
+
+@user.patch("/organisation/{org_id}/settings")
+async def update_organisation_settings(
+    org_id: int, body: JsonPatchSchema, session: AsyncSession = Depends(get_db_session)
+):
+    changes, remove = json_changes(body)
+    settings = await organisations.patch_json(session, "settings", changes, remove, id=org_id)
+    if settings is None:
+        raise HTTPException(detail="Organisation not found", status_code=status.HTTP_404_NOT_FOUND)
+
+    return {"message": "Organisation settings updated", "status": "success", "data": settings}
+
+
+@user.delete("/organisation/{org_id}", status_code=status.HTTP_202_ACCEPTED)
+async def delete_organisation(org_id: int, session: AsyncSession = Depends(get_db_session)):
+    organisation = await organisations.get_or_none(session, id=org_id)
+    if not organisation:
+        raise HTTPException(detail="Organisation not found", status_code=status.HTTP_404_NOT_FOUND)
+
+    organisation.status = Status.PURGING
+    await session.commit()
+    schedule_purge(org_id)
+
+    return {
+        "message": "Organisation scheduled for deletion",
+        "status": "success",
+        "data": {},
+    }
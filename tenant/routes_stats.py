@@ -4,18 +4,69 @@ from typing import Optional
 
 from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
 from sqlalchemy import and_, cast, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.types import TIMESTAMP
 
-from core.db_manager import DatabaseManager
+from core.hll import RELATIVE_ERROR
+from core.settings import settings
 
 from .models import Member, Organisation, Role, User, get_db_session
 from .schemas import *
+from .sketches import distinct_users
+from .versions import current_version, make_etag
 
 statistics = APIRouter(prefix="/api/stats", tags=["Stats"])
 
 
+async def not_modified(request: Request, response: Response, session: AsyncSession):
+    """Set ETag and Cache-Control, and return a 304 if the client already has this version.
+
+    Runs before any aggregation so an unchanged poll costs a single version lookup.
+    """
+    version = await current_version(session)
+    etag = make_etag(version, request.url.path, request.query_params)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"private, max-age={settings.STATS_MAX_AGE}, must-revalidate",
+    }
+    response.headers.update(headers)
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if "*" in tags or etag in tags:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return None
+
+
+def approximate_response(counts: dict):
+    return {
+        "message": "Data fetched successfully",
+        "status": "success",
+        "data": {
+            "relative_error": RELATIVE_ERROR,
+            # Sketches only ever grow, so a user who changed role is still in the old one.
+            "note": "Counts include every user who held the role at any time in the window",
+            "counts": counts,
+        },
+    }
+
+
 @statistics.get("/roles/users/count", response_model=BaseResponseSchema)
-async def role_wise_users(db: DatabaseManager = Depends(get_db_session)):
+async def role_wise_users(
+    request: Request,
+    response: Response,
+    approx: bool = Query(False),
+    session: AsyncSession = Depends(get_db_session),
+):
+    cached = await not_modified(request, response, session)
+    if cached:
+        return cached
+
+    if approx:
+        counts = await distinct_users(session, group_by=(Role.name,))
+        return approximate_response({role: count for (role,), count in counts.items()})
+
     query = (
         select(Role.name.label("role"), func.count(User.id).label("count"))
         .join(Member, Role.id == Member.role_id)
@@ -23,7 +74,7 @@ async def role_wise_users(db: DatabaseManager = Depends(get_db_session)):
         .group_by(Role.id)
     )
 
-    result = await db.session.execute(query)
+    result = await session.execute(query)
     user_count_by_role = result.fetchall()
     data = {x[0]: x[1] for x in user_count_by_role}
     return {"message": "Data fetched successfully", "status": "success", "data": data}
@@ -31,10 +82,16 @@ async def role_wise_users(db: DatabaseManager = Depends(get_db_session)):
 
 @statistics.get("/org/member/count", response_model=BaseResponseSchema)
 async def organisation_wise_members(
+    request: Request,
+    response: Response,
     time_from: Optional[datetime] = Query(None, alias="from"),
     time_to: Optional[datetime] = Query(None, alias="to"),
-    db: DatabaseManager = Depends(get_db_session),
+    session: AsyncSession = Depends(get_db_session),
 ):
+    cached = await not_modified(request, response, session)
+    if cached:
+        return cached
+
     query = select(Organisation.name.label("name"), func.count(Member.id).label("count")).join(
         Member, Member.org_id == Organisation.id
     )
@@ -43,7 +100,7 @@ async def organisation_wise_members(
         query = query.where(Member.created_at.between(time_from, time_to))
 
     query = query.group_by(Organisation.id)
-    result = await db.session.execute(query)
+    result = await session.execute(query)
     member_count_by_org = result.fetchall()
     data = {x[0]: x[1] for x in member_count_by_org}
     return {"message": "Data fetched successfully", "status": "success", "data": data}
@@ -51,10 +108,29 @@ async def organisation_wise_members(
 
 @statistics.get("/org/roles/users/count", response_model=BaseResponseSchema)
 async def organisation_and_role_wise_members(
+    request: Request,
+    response: Response,
     time_from: Optional[datetime] = Query(None, alias="from"),
     time_to: Optional[datetime] = Query(None, alias="to"),
-    db: DatabaseManager = Depends(get_db_session),
+    approx: bool = Query(False),
+    session: AsyncSession = Depends(get_db_session),
 ):
+    cached = await not_modified(request, response, session)
+    if cached:
+        return cached
+
+    if approx:
+        counts = await distinct_users(
+            session,
+            group_by=(Organisation.name, Role.name),
+            time_from=time_from,
+            time_to=time_to,
+        )
+        data = defaultdict(dict)
+        for (org_name, role_name), count in counts.items():
+            data[org_name][role_name] = count
+        return approximate_response(dict(data))
+
     query = (
         select(
             Organisation.id.label("organisation_id"),
@@ -69,11 +145,15 @@ async def organisation_and_role_wise_members(
     )
 
     if time_from and time_to:
-        query = query.where(User.created_at.between(time_from, time_to))
+        # A membership is never older than its user, so the extra bound on the partition
+        # key keeps the result unchanged while letting the planner skip older partitions.
+        query = query.where(
+            User.created_at.between(time_from, time_to), Member.created_at >= time_from
+        )
 
     query = query.group_by(Organisation.id, Organisation.name, Role.id, Role.name)
 
-    result = await db.session.execute(query)
+    result = await session.execute(query)
     org_role_wise_member = result.fetchall()
 
     data = defaultdict(lambda: defaultdict(int))
@@ -1,4 +1,8 @@
-from pydantic import BaseModel, EmailStr, model_validator
+from typing import Any, Dict, List
+
+from pydantic import BaseModel, EmailStr, Field, model_validator
+
+from core.db_manager import overlapping_paths
 
 
 class RegisterUserSchema(BaseModel):
@@ -37,6 +41,35 @@ class UpdateMemberSchema(BaseModel):
     role_id: int
 
 
+class MemberRoleSchema(BaseModel):
+    user_id: int
+    role_id: int
+
+
+class BatchUpdateMemberSchema(BaseModel):
+    org_id: int
+    members: List[MemberRoleSchema] = Field(min_length=1, max_length=1000)
+
+
+class JsonPatchSchema(BaseModel):
+    # Keys are dotted paths, e.g. {"notifications.email": false}.
+    update: Dict[str, Any] = {}
+    remove: List[str] = []
+
+    @model_validator(mode="after")
+    def check_paths(self):
+        paths = [*self.update, *self.remove]
+        if not paths:
+            raise ValueError("nothing to update or remove")
+        if any(not all(path.split(".")) for path in paths):
+            raise ValueError("key paths must not contain empty keys")
+        overlap = overlapping_paths(path.split(".") for path in paths)
+        if overlap:
+            shorter, longer = (".".join(keys) for keys in overlap)
+            raise ValueError(f"key paths {shorter} and {longer} overlap")
+        return self
+
+
 class BaseResponseSchema(BaseModel):
     message: str
     status: str = "success"
@@ -0,0 +1,175 @@
+import asyncio
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+
+from sqlalchemy import cast, delete, func, literal_column, or_, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.types import Date
+
+from core.db_manager import get_session_manager, resolve_session, session_scope
+from core.hll import REGISTERS, HyperLogLog, register_for
+from core.settings import settings
+
+from .models import Member, MemberSketch, MemberSketchMonth, Organisation, Role
+from .versions import bump_version
+
+
+async def record_membership(session, org_id: int, role_id: int, user_id: int, day=None):
+    await record_memberships(session, org_id, role_id, [user_id], day=day)
+
+
+async def record_memberships(session, org_id: int, role_id: int, user_ids, day=None):
+    """Add users to the (org, role, day) sketch and its monthly rollup without reading them.
+
+    A single user raises one register with set_byte. Several users are folded into
+    a delta sketch that is merged register by register on the server.
+    """
+    delta = HyperLogLog()
+    for user_id in user_ids:
+        delta.add(user_id)
+    day = day or datetime.now(tz=timezone.utc).date()
+
+    for model, period in (
+        (MemberSketch, {"day": day}),
+        (MemberSketchMonth, {"month": day.replace(day=1)}),
+    ):
+        query = pg_insert(model).values(
+            org_id=org_id, role_id=role_id, registers=bytes(delta.registers), **period
+        )
+        if len(user_ids) == 1:
+            index, rank = register_for(user_ids[0])
+            registers = func.set_byte(
+                model.registers, index, func.greatest(func.get_byte(model.registers, index), rank)
+            )
+        else:
+            # Register-wise max of the stored and the incoming sketch, computed in place.
+            registers = literal_column(
+                "(SELECT decode(string_agg(lpad(to_hex(greatest("
+                f"get_byte({model.__tablename__}.registers, i), get_byte(excluded.registers, i))"
+                f"), 2, '0'), '' ORDER BY i), 'hex') FROM generate_series(0, {REGISTERS - 1}) AS i)"
+            )
+        query = query.on_conflict_do_update(
+            index_elements=[model.org_id, model.role_id, *(getattr(model, k) for k in period)],
+            set_={"registers": registers},
+        )
+        await session.execute(query)
+
+
+def split_window(first: date, last: date):
+    """Split the days [first, last] into whole months [start, end) and the days at either end."""
+    start = first if first.day == 1 else (first.replace(day=1) + timedelta(days=31)).replace(day=1)
+    end = (last + timedelta(days=1)).replace(day=1)
+    if start >= end:
+        return None, [(first, last)]
+    edges = [(first, start - timedelta(days=1)), (end, last)]
+    return (start, end), [(lo, hi) for lo, hi in edges if lo <= hi]
+
+
+def sketch_query(model, group_by):
+    return (
+        select(*group_by, model.registers)
+        .select_from(model)
+        .join(Organisation, Organisation.id == model.org_id)
+        .join(Role, Role.id == model.role_id)
+    )
+
+
+async def distinct_users(session, group_by, time_from=None, time_to=None):
+    """Merge the sketches in the window into one estimate per `group_by` key.
+
+    Whole months come from the monthly rollup and only the days at the edges of the
+    window from the daily sketches, so a key costs O(months) rows rather than O(days).
+    Users are counted in every role they held during the window.
+    """
+    queries = []
+    if time_from and time_to:
+        months, days = split_window(time_from.date(), time_to.date())
+        if months:
+            queries.append(
+                sketch_query(MemberSketchMonth, group_by).where(
+                    MemberSketchMonth.month >= months[0], MemberSketchMonth.month < months[1]
+                )
+            )
+        if days:
+            queries.append(
+                sketch_query(MemberSketch, group_by).where(
+                    or_(*(MemberSketch.day.between(lo, hi) for lo, hi in days))
+                )
+            )
+    else:
+        queries.append(sketch_query(MemberSketchMonth, group_by))
+
+    sketches = defaultdict(HyperLogLog)
+    for query in queries:
+        for *key, registers in await session.execute(query):
+            sketches[tuple(key)].merge(registers)
+    return {key: sketch.count() for key, sketch in sketches.items()}
+
+
+# Register-wise max of the daily sketches of each month.
+ROLLUP_MONTHS = f"""
+INSERT INTO member_sketch_month (org_id, role_id, month, registers)
+SELECT org_id, role_id, month, decode(string_agg(lpad(to_hex(rank), 2, '0'), '' ORDER BY i), 'hex')
+FROM (
+    SELECT org_id, role_id, date_trunc('month', day)::date AS month, i,
+        max(get_byte(registers, i)) AS rank
+    FROM member_sketch CROSS JOIN generate_series(0, {REGISTERS - 1}) AS i
+    GROUP BY 1, 2, 3, 4
+) registers
+GROUP BY org_id, role_id, month
+"""
+
+
+async def rebuild_sketches(session=None, batch_size: int = 1000):
+    """Recompute every sketch from the member table, e.g. after the initial migration."""
+    session = resolve_session(session)
+    result = await session.execute(delete(MemberSketch).returning(MemberSketch.org_id))
+    org_ids = set(result.scalars().all())
+    day = cast(func.timezone("UTC", Member.created_at), Date)
+    query = (
+        select(Member.org_id, Member.role_id, day, Member.user_id)
+        .order_by(Member.org_id, Member.role_id, day)
+        .execution_options(yield_per=10_000)
+    )
+
+    # Rows arrive grouped by bucket, so only one sketch is held in memory at a time.
+    rebuilt, rows, bucket, sketch = 0, [], None, None
+    async for org_id, role_id, member_day, user_id in await session.stream(query):
+        org_ids.add(org_id)
+        if bucket != (org_id, role_id, member_day):
+            if sketch:
+                rows.append(sketch_row(bucket, sketch))
+            if len(rows) >= batch_size:
+                await session.execute(pg_insert(MemberSketch), rows)
+                rebuilt, rows = rebuilt + len(rows), []
+            bucket, sketch = (org_id, role_id, member_day), HyperLogLog()
+        sketch.add(user_id)
+    if sketch:
+        rows.append(sketch_row(bucket, sketch))
+    if rows:
+        await session.execute(pg_insert(MemberSketch), rows)
+        rebuilt += len(rows)
+
+    result = await session.execute(delete(MemberSketchMonth).returning(MemberSketchMonth.org_id))
+    org_ids.update(result.scalars().all())
+    await session.execute(text(ROLLUP_MONTHS))
+    # Every approximate count of these organisations may have changed.
+    await bump_version(session, *org_ids)
+    await session.commit()
+    return rebuilt
+
+
+def sketch_row(bucket, sketch):
+    org_id, role_id, day = bucket
+    return {"org_id": org_id, "role_id": role_id, "day": day, "registers": bytes(sketch.registers)}
+
+
+async def main():
+    db = get_session_manager(settings.DB_URL, **settings.db_options)
+    async with session_scope(db):
+        print(f"Rebuilt {await rebuild_sketches()} sketch(es)")
+    await db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,11 +1,17 @@
 from datetime import datetime, timedelta, timezone
 from enum import Enum
 from typing import Any
+from uuid import uuid4
 
-import jwt
 from fastapi import Request
+from sqlalchemy import delete, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
+from core.cache import LRUCache
 from core.settings import settings
+from core.tracing import span
+
+from .models import ConsumedToken
 
 
 class Audience(Enum):
@@ -22,12 +28,16 @@ class Audience(Enum):
 class JWTUtils:
 
     @classmethod
+    @span("jwt.encode")
     async def encode_token(cls, payload, exp: timedelta):
+        import jwt
+
         now = datetime.now(tz=timezone.utc)
         if "aud" not in payload:
             raise jwt.exceptions.InvalidAudienceError("Audience required to encode token")
         payload["iat"] = now
         payload["exp"] = now + exp
+        payload["jti"] = uuid4().hex
         key = settings.SECRET_KEY
         token = jwt.encode(payload=payload, key=key, algorithm=settings.JWT_ALGORITHM)
         return token
@@ -51,7 +61,10 @@ class JWTUtils:
         return token
 
     @classmethod
+    @span("jwt.decode")
     async def decode_token(cls, token: str, aud: Any, request: Request):
+        import jwt
+
         try:
             key = settings.SECRET_KEY
             payload = jwt.decode(
@@ -68,3 +81,50 @@ class JWTUtils:
             return None
         except jwt.exceptions.PyJWTError:
             return None
+
+
+class ConsumedTokens:
+    """Tracks single-use tokens (invites, password resets) by their `jti` claim.
+
+    The consumed_token table is the source of truth: consuming is one
+    insert-or-ignore, so checking and marking a token costs a single round trip
+    and concurrent replays cannot both win. Tokens this worker has already seen
+    consumed are rejected from memory without touching the database.
+    """
+
+    def __init__(self, lru_size: int, cleanup_every: int = 1000):
+        self._recent = LRUCache(lru_size)
+        self._cleanup_every = cleanup_every
+        self._consumed = 0
+
+    def seen(self, jti: str):
+        return jti in self._recent
+
+    def remember(self, jti: str):
+        self._recent.set(jti, True)
+
+    async def consume(self, session, payload: dict):
+        jti = payload.get("jti")
+        if not jti or self.seen(jti):
+            return False
+        expires_at = datetime.fromtimestamp(payload["exp"], tz=timezone.utc)
+        result = await session.execute(
+            pg_insert(ConsumedToken)
+            .values(jti=jti, expires_at=expires_at)
+            .on_conflict_do_nothing()
+            .returning(ConsumedToken.jti)
+        )
+        if result.scalar_one_or_none() is None:
+            self.remember(jti)
+            return False
+
+        self._consumed += 1
+        if self._consumed % self._cleanup_every == 0:
+            await self.purge_expired(session)
+        return True
+
+    async def purge_expired(self, session):
+        await session.execute(delete(ConsumedToken).where(ConsumedToken.expires_at < func.now()))
+
+
+consumed_tokens = ConsumedTokens(lru_size=settings.CONSUMED_TOKEN_LRU_SIZE)
@@ -1,19 +1,22 @@
-import sendgrid
 from fastapi import HTTPException, status
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import (
-    ClickTracking,
-    Content,
-    Email,
-    Mail,
-    To,
-    TrackingSettings,
-)
 
 from core.settings import settings
+from core.tracing import span
 
 
+@span("mail.send")
 async def send_mail(to_email, subject, content):
+    # sendgrid pulls in a large dependency tree, so it is imported on the first mail sent.
+    from sendgrid import SendGridAPIClient
+    from sendgrid.helpers.mail import (
+        ClickTracking,
+        Content,
+        Email,
+        Mail,
+        To,
+        TrackingSettings,
+    )
+
     sg = SendGridAPIClient(api_key=settings.EMAIL_KEY)
     from_email = Email(settings.EMAIL_USER)
     to_email = To(to_email)
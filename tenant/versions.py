@@ -0,0 +1,38 @@
+import hashlib
+
+from sqlalchemy import Sequence, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from .models import DataVersion
+
+version_seq = Sequence("data_version_seq")
+
+
+async def bump_version(session, *org_ids: int):
+    """Give each organisation a fresh version from a sequence."""
+    if not org_ids:
+        return
+    # Rows are locked in org_id order, so concurrent bumps cannot deadlock.
+    query = pg_insert(DataVersion).values(
+        [{"org_id": org_id, "version": version_seq.next_value()} for org_id in sorted(set(org_ids))]
+    )
+    # The value is drawn again once the row is locked; one drawn before the lock could be
+    # lower than what a concurrent bump has committed meanwhile and move the version back.
+    query = query.on_conflict_do_update(
+        index_elements=[DataVersion.org_id], set_={"version": version_seq.next_value()}
+    )
+    await session.execute(query)
+
+
+async def current_version(session) -> int:
+    # Versions only ever grow and rows are never removed, so every committed bump
+    # changes the sum, even when transactions commit out of sequence order. This reads
+    # one row per organisation; a single total row would serialise every membership write.
+    result = await session.execute(select(func.coalesce(func.sum(DataVersion.version), 0)))
+    return int(result.scalar())
+
+
+def make_etag(version: int, path: str, params) -> str:
+    query = "&".join(f"{k}={v}" for k, v in sorted(params.multi_items()))
+    digest = hashlib.sha1(f"{version}|{path}|{query}".encode()).hexdigest()
+    return f'"{digest[:20]}"'